@@ -1,15 +1,90 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, url_for, g
 from werkzeug.utils import secure_filename
 import os
-from labels.label_design_1 import LabelDesign1
-from labels.label_design_2 import LabelDesign2
+import hashlib
+from labels.render import (
+    get_design, render_print_label, render_preview, render_pdf, render_thumbnail, encode_thumbnail,
+    warm_worker, worker_stats, label_size, master_size, LABEL_SIZE, PREVIEW_MIMETYPES
+)
+from labels.ingest import ingest_image, image_format, INGEST_FORMATS
+from labels.image_cache import image_cache
+from labels.layer_cache import layer_cache
+from labels.fonts import font_registry
+from labels.compositing import compositor
+from labels.design_engine import design_registry, DESIGN_DIR, DEFAULT_DESIGN
 from database.schema import init_db
 from database.db_manager import DBManager
+from pdf_generator import PDFGenerator
+from render_cache import RenderCache
+from upload_janitor import UploadJanitor
+from instrumentation import metrics
+from render_executor import RenderExecutor, RenderError, RenderQueueFull, RenderTimeout, RenderSuperseded, RenderWorkerLost
+import base64
+import cProfile
+import datetime
+import io
+import itertools
 import json
+import logging
+import math
+import tempfile
+import time
+import click
+from PIL import Image
 
 app = Flask(__name__, static_url_path='', static_folder='static')
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['IMAGE_CACHE_MAX_BYTES'] = 128 * 1024 * 1024  # decoded background images
+app.config['LAYER_CACHE_SESSIONS'] = 64  # labels whose preview layers are kept for re-renders, per worker
+app.config['RENDER_BACKEND'] = os.environ.get('LABELIZER_RENDER_BACKEND', 'process')  # 'process' or 'thread'
+app.config['RENDER_WORKERS'] = int(os.environ.get('LABELIZER_RENDER_WORKERS', os.cpu_count() or 2))  # per server process
+app.config['RENDER_QUEUE_SIZE'] = 16  # jobs allowed to wait for a worker before we answer 503
+app.config['RENDER_TIMEOUT'] = 30  # seconds
+app.config['RENDER_RETRY_AFTER'] = 2  # seconds, sent with 503 responses
+app.config['RENDER_PRELOAD_IMAGES'] = 8  # most recent uploads decoded by each worker at start
+# Views running at once per process in ASGI mode. More requests wait on the event loop,
+# as many as the render queue takes so they are not turned away with 503s.
+app.config['ASGI_THREADS'] = int(os.environ.get(
+    'LABELIZER_ASGI_THREADS', app.config['RENDER_WORKERS'] + app.config['RENDER_QUEUE_SIZE']
+))
+app.config['PREVIEW_FORMAT'] = 'WEBP'  # WEBP, JPEG or PNG (fast, low compression)
+app.config['PREVIEW_QUALITY'] = 80  # WEBP/JPEG quality
+app.config['PREVIEW_SCALE'] = 0.5  # draft previews, 270x300
+app.config['PREVIEW_RESAMPLE'] = 'BILINEAR'  # Pillow filter used to scale the background
+app.config['PDF_DPI'] = 300
+app.config['PDF_SPOOL_BYTES'] = 8 * 1024 * 1024  # batch PDFs larger than this are buffered on disk
+app.config['BATCH_MAX_QUANTITY'] = 500  # copies of one label in a batch PDF
+app.config['BATCH_MAX_LABELS'] = 2000  # labels printed by one batch PDF, all items together
+app.config['PDF_VECTOR_TEXT'] = True  # Embed fonts and draw text as vectors, only the background is a bitmap
+app.config['UPLOAD_MAX_PIXELS'] = 50 * 1000 * 1000  # larger images are rejected before they are decoded
+app.config['UPLOAD_MASTER_SIZE'] = master_size(app.config['PDF_DPI'])  # stored images cover every print size
+app.config['UPLOAD_WORKING_SIZE'] = LABEL_SIZE  # editor previews and thumbnails render from a copy this size
+app.config['UPLOAD_JPEG_QUALITY'] = 92  # JPEG uploads are stored as JPEG, PNG as PNG
+app.config['RENDER_CACHE_DIR'] = 'cache/renders'
+app.config['RENDER_CACHE_MEMORY_BYTES'] = 32 * 1024 * 1024
+app.config['RENDER_CACHE_DISK_BYTES'] = 512 * 1024 * 1024
+app.config['UPLOAD_JANITOR'] = os.environ.get('LABELIZER_UPLOAD_JANITOR', 'thread')  # 'thread' or 'cli' (flask clean-uploads)
+app.config['UPLOAD_MAX_AGE'] = 7 * 24 * 60 * 60  # uploads unused this long are deleted, saved labels keep a copy in the database
+app.config['UPLOAD_MAX_BYTES'] = 2 * 1024 * 1024 * 1024  # quota, enforced by deleting uploads the database can restore
+app.config['UPLOAD_ACTIVE_SECONDS'] = 15 * 60  # uploads used this recently are never deleted
+app.config['UPLOAD_JANITOR_INTERVAL'] = 15 * 60  # seconds between sweeps of the background thread
+app.config['LABEL_PAGE_SIZE'] = 50  # labels per page on the list page
+app.config['LABEL_PAGE_SIZE_MAX'] = 200
+app.config['THUMBNAIL_SIZE'] = (135, 150)  # a quarter of the label
+app.config['THUMBNAIL_FORMAT'] = 'WEBP'  # WEBP or JPEG
+app.config['THUMBNAIL_QUALITY'] = 75
+app.config['THUMBNAIL_MAX_AGE'] = 365 * 24 * 60 * 60  # thumbnail URLs change with their content
+app.config['COMPOSITING_ENGINE'] = os.environ.get('LABELIZER_COMPOSITOR', 'pillow')  # 'pillow' or 'numpy'
+app.config['FONT_DIR'] = os.environ.get('LABELIZER_FONT_DIR', 'fonts')
+app.config['DESIGN_DIR'] = os.environ.get('LABELIZER_DESIGN_DIR', DESIGN_DIR)  # one JSON spec per design type
+app.config['LOG_LEVEL'] = os.environ.get('LABELIZER_LOG_LEVEL', 'INFO')
+app.config['PROFILE_REQUESTS'] = os.environ.get('LABELIZER_PROFILE') == '1'  # honour the X-Profile request header
+app.config['PROFILE_DIR'] = 'cache/profiles'
+
+# A server that configured logging already keeps its setup
+logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
@@ -19,98 +94,572 @@ def allowed_file(filename):
 # Initialize the database
 init_db()
 db_manager = DBManager()
+image_cache.max_bytes = app.config['IMAGE_CACHE_MAX_BYTES']
+layer_cache.max_sessions = app.config['LAYER_CACHE_SESSIONS']
+
+# Resolve fonts once at startup so missing ones are reported a single time
+font_registry.configure(app.config['FONT_DIR'])
+# Part of every render cache key, renders with other (or fallback) fonts are never reused
+FONTS_DIGEST = font_registry.digest()
+design_registry.configure(app.config['DESIGN_DIR'])
+app.config['COMPOSITING_ENGINE'] = compositor.configure(app.config['COMPOSITING_ENGINE'])
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# (file signature, content hash) of the stored uploads, keyed by uuid
+image_hashes = {}
+# (master signature, content hash of the file the browser sent) of the last ingested uploads
+source_hashes = {}
+
+def recent_uploads(limit):
+    """Paths of the most recently written working copies, what previews render from"""
+    folder = app.config['UPLOAD_FOLDER']
+    paths = [
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if '.working.' in name and allowed_file(name)
+    ]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    return paths[:limit]
+
+# Pillow and ReportLab work runs here instead of on the request threads
+render_executor = RenderExecutor(
+    backend=app.config['RENDER_BACKEND'],
+    max_workers=app.config['RENDER_WORKERS'],
+    max_queue=app.config['RENDER_QUEUE_SIZE'],
+    timeout=app.config['RENDER_TIMEOUT'],
+    initializer=warm_worker,
+    initargs=(
+        app.config['FONT_DIR'],
+        app.config['IMAGE_CACHE_MAX_BYTES'],
+        recent_uploads(app.config['RENDER_PRELOAD_IMAGES']),
+        app.config['COMPOSITING_ENGINE'],
+        app.config['DESIGN_DIR'],
+        app.config['LAYER_CACHE_SESSIONS']
+    ),
+    # The image and layer caches live in the workers, see worker_cache_stats()
+    worker_stats=worker_stats
+)
+
+# Rendered previews and PDFs, keyed by everything that determines their content
+render_cache = RenderCache(
+    cache_dir=app.config['RENDER_CACHE_DIR'],
+    memory_bytes=app.config['RENDER_CACHE_MEMORY_BYTES'],
+    disk_bytes=app.config['RENDER_CACHE_DISK_BYTES']
+)
+
+def upload_restorable(path):
+    """Whether a file in the upload folder can be recreated once deleted"""
+    uuid, _, ext = os.path.basename(path).partition('.')
+    if ext not in INGEST_FORMATS.values() or uuid.startswith(('preview_', 'label_')):
+        # Working copies are ingested again from the master, rendered output
+        # from older versions is never read again
+        return True
+    row = db_manager.get_beer_label_metadata(uuid)
+    return bool(row and row[17] and row[17] == stored_image_hash(uuid))
+
+def forget_upload(path):
+    uuid = os.path.basename(path).partition('.')[0]
+    image_hashes.pop(uuid, None)
+    image_cache.invalidate(path)
+
+# Keeps static/uploads from growing without bound
+upload_janitor = UploadJanitor(
+    app.config['UPLOAD_FOLDER'],
+    max_age=app.config['UPLOAD_MAX_AGE'],
+    max_bytes=app.config['UPLOAD_MAX_BYTES'],
+    active_seconds=app.config['UPLOAD_ACTIVE_SECONDS'],
+    interval=app.config['UPLOAD_JANITOR_INTERVAL'],
+    restorable=upload_restorable,
+    on_remove=forget_upload
+)
+if app.config['UPLOAD_JANITOR'] == 'thread':
+    upload_janitor.start()
+
+def worker_cache_stats(name):
+    """Stats of a render worker cache summed over the workers, None before any worker reported"""
+    snapshots = render_executor.worker_stats_snapshots()
+    if not snapshots:
+        return None
+    totals = {'workers': len(snapshots)}
+    for snapshot in snapshots:
+        for key, value in snapshot[name].items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+def worker_fonts():
+    """Font file each family/weight resolved to in the render workers, None for the default font"""
+    snapshots = render_executor.worker_stats_snapshots()
+    if not snapshots:
+        return None
+    fonts = {}
+    for snapshot in snapshots:
+        fonts.update(snapshot['fonts'])
+    return fonts
+
+def worker_cache_gauge(name, key):
+    stats = worker_cache_stats(name)
+    return stats[key] if stats is not None else None
+
+# Current state next to the histograms and counters on /metrics
+metrics.gauge('render_queue_depth', lambda: render_executor.stats()['queue_depth'])
+metrics.gauge('render_workers_busy', lambda: render_executor.stats()['running'])
+metrics.gauge('image_cache_bytes', lambda: worker_cache_gauge('image_cache', 'bytes'))
+metrics.gauge('render_cache_memory_bytes', lambda: render_cache.stats()['memory_bytes'])
+metrics.gauge('render_cache_disk_bytes', lambda: render_cache.stats()['disk_bytes'])
+metrics.gauge('upload_bytes', lambda: upload_janitor.stats()['bytes_stored'])
+metrics.gauge('upload_reclaimed_bytes', lambda: upload_janitor.stats()['bytes_reclaimed'])
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if app.config['PROFILE_REQUESTS'] and request.headers.get('X-Profile'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.pop('request_start', time.perf_counter())
+    metrics.observe('request_seconds', elapsed, endpoint=request.endpoint or 'unknown',
+                    method=request.method, status=response.status_code)
+    response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}'
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # Only this request thread is profiled, render stages show up on /metrics
+        profiler.disable()
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        filename = f"{stamp}-{request.endpoint or 'unknown'}.prof"
+        profiler.dump_stats(os.path.join(app.config['PROFILE_DIR'], filename))
+        response.headers['X-Profile'] = filename
+        logger.info("Profile of %s %s written to %s", request.method, request.path, filename)
+    return response
+
+@app.teardown_request
+def stop_profiler(exc):
+    # after_request does not run when a request fails
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Stage and request histograms, cache counters and gauges for Prometheus"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.errorhandler(RenderQueueFull)
+@app.errorhandler(RenderTimeout)
+@app.errorhandler(RenderWorkerLost)
+def render_overloaded(e):
+    response = jsonify({'error': str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config['RENDER_RETRY_AFTER'])
+    return response
+
+@app.errorhandler(RenderSuperseded)
+def render_superseded(e):
+    # A newer preview for the same label replaced this one, nobody will look at it
+    return jsonify({'error': str(e), 'superseded': True}), 409
+
+def upload_path(uuid, image_format=None):
+    """Path of the stored background image (the master) for a label.
+
+    Without image_format the stored file is looked up, its extension
+    depends on the format of the upload.
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    if image_format:
+        return os.path.join(folder, f"{uuid}.{INGEST_FORMATS[image_format]}")
+    for ext in INGEST_FORMATS.values():
+        filepath = os.path.join(folder, f"{uuid}.{ext}")
+        if os.path.exists(filepath):
+            return filepath
+    # Uploads from before ingestion were always stored as .png
+    return os.path.join(folder, f"{uuid}.png")
+
+def working_path(filepath):
+    """Path of the editor-resolution copy stored next to a master"""
+    root, ext = os.path.splitext(filepath)
+    return f"{root}.working{ext}"
+
+def content_hash(data):
+    """SHA-256 hex digest of raw image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+def file_signature(filepath):
+    """Identity of a stored file, None when it does not exist.
+
+    Uploads are replaced (write_file) rather than rewritten, so a new inode
+    means new content, also when another server process wrote it. The
+    janitor's touch() only changes the mtime and keeps the signature.
+    """
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size
+
+def stored_image_hash(uuid):
+    """Content hash of the stored upload for a label, or None if there is none"""
+    filepath = upload_path(uuid)
+    signature = file_signature(filepath)
+    if signature is None:
+        return None
+    cached = image_hashes.get(uuid)
+    if cached is None or cached[0] != signature:
+        with open(filepath, 'rb') as f:
+            cached = image_hashes[uuid] = (signature, content_hash(f.read()))
+    return cached[1]
+
+def parse_number(values, name, default, cast=float):
+    """A numeric label parameter, the default when it is missing or empty.
+
+    Raises ValueError for anything that is not a finite number.
+    """
+    value = values.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    return number
+
+def parse_label_data(values):
+    """Build label parameters from a form or JSON mapping, applying defaults.
+
+    Raises ValueError when a numeric parameter is not a number.
+    """
+    return {
+        'beer_name': values.get('beer_name', ''),
+        'subtitle': values.get('subtitle', ''),
+        'abv': values.get('abv', ''),
+        'beer_size': values.get('beer_size', '500ML'),
+        'border_color': values.get('border_color', '#000000'),
+        'text_color': values.get('text_color', '#000000'),
+        'font': values.get('font', 'Arial'),
+        'font_size': parse_number(values, 'font_size', 32, int),
+        'image_scale': parse_number(values, 'image_scale', 100.0),
+        'image_x': parse_number(values, 'image_x', 50.0),
+        'image_y': parse_number(values, 'image_y', 50.0),
+        'crop_x': parse_number(values, 'crop_x', 50.0),
+        'crop_y': parse_number(values, 'crop_y', 50.0),
+        'description': values.get('description', ''),
+        'design_type': values.get('design_type', DEFAULT_DESIGN)
+    }
+
+def row_to_label_data(row):
+    """Convert a BeerLabel database row to label parameters"""
+    return {
+        'beer_name': row[1],
+        'subtitle': row[2],
+        'abv': row[3],
+        'beer_size': row[4],
+        'border_color': row[5],
+        'text_color': row[6],
+        'font': row[7],
+        'font_size': row[8],
+        'image_scale': row[9],
+        'image_x': row[10],
+        'image_y': row[11],
+        'crop_x': row[12],
+        'crop_y': row[13],
+        'description': row[14],
+        'design_type': row[15]
+    }
+
+def replace_file(filepath, chunks):
+    """Write chunks to a private temporary file next to filepath and move it into place.
+
+    Renders never see the file half written, and server processes writing
+    the same file at once each replace it whole.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def write_file(filepath, data):
+    """Replace a file in one step, renders never see it half written"""
+    replace_file(filepath, [data])
+    image_cache.invalidate(filepath)
+
+def write_upload(uuid, image_format, master, working):
+    """Store the ingested master and working copy of a label's image and return the master's path"""
+    filepath = upload_path(uuid, image_format)
+    for ext in INGEST_FORMATS.values():
+        # A new upload in another format replaces the old files
+        stale = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid}.{ext}")
+        for path in (stale, working_path(stale)):
+            if stale != filepath and os.path.exists(path):
+                os.remove(path)
+                image_cache.invalidate(path)
+
+    write_file(working_path(filepath), working)
+    write_file(filepath, master)
+    image_hashes[uuid] = (file_signature(filepath), content_hash(master))
+    return filepath
+
+def ingest_upload(uuid, image_data):
+    """Validate and normalise uploaded image bytes and store them for a label.
+
+    Runs in a render worker. The same bytes uploaded again are not ingested
+    twice. Returns the master's path, raises ValueError for unusable images.
+    """
+    source_hash = content_hash(image_data)
+    filepath = upload_path(uuid)
+    # Unless another server process stored a different image since
+    unchanged = source_hashes.get(uuid) == (file_signature(filepath), source_hash)
+    if unchanged and os.path.exists(working_path(filepath)):
+        return filepath
+
+    image_format, master, working = render_executor.run(
+        ingest_image, image_data, app.config['UPLOAD_MAX_PIXELS'], app.config['UPLOAD_MASTER_SIZE'],
+        app.config['UPLOAD_WORKING_SIZE'], app.config['UPLOAD_JPEG_QUALITY']
+    )
+    filepath = write_upload(uuid, image_format, master, working)
+    source_hashes[uuid] = (file_signature(filepath), source_hash)
+    return filepath
+
+def preview_cache_key(uuid, label_data):
+    """Render cache key of a preview, known before rendering it"""
+    return render_cache.make_key(
+        'preview', get_design(label_data.get('design_type', DEFAULT_DESIGN)).key, label_data,
+        stored_image_hash(uuid), label_size(app.config['PREVIEW_SCALE']),
+        format=app.config['PREVIEW_FORMAT'], quality=app.config['PREVIEW_QUALITY'],
+        resample=app.config['PREVIEW_RESAMPLE'], fonts=FONTS_DIGEST
+    )
+
+def preview_etag(uuid, label_data):
+    """ETag of a preview, known before rendering it"""
+    return preview_cache_key(uuid, label_data)[:32]
+
+def restore_upload(uuid):
+    """Copy the image of a label from the database to the upload folder, None when there is none"""
+    # Copy the blob out of the database in chunks, never holding all of it in memory
+    chunks = db_manager.iter_beer_label_image(uuid)
+    first = next(chunks, b'')
+    if not first:
+        return None
+
+    filepath = upload_path(uuid, image_format(first) or 'PNG')
+    digest = hashlib.sha256()
+
+    def hashed(chunks):
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
+    replace_file(filepath, hashed(itertools.chain([first], chunks)))
+    image_hashes[uuid] = (file_signature(filepath), digest.hexdigest())
+    image_cache.invalidate(filepath)
+    return filepath
+
+def ensure_upload(uuid):
+    """Path of the master image for a label, restored from the database on first use.
+
+    A missing working copy is ingested again, which also normalises images
+    stored before uploads were ingested. Returns None when the label has no image.
+    """
+    filepath = upload_path(uuid)
+    # Marking the files as used keeps the janitor away from them while they are rendered
+    if not upload_janitor.touch(filepath):
+        filepath = restore_upload(uuid)
+        if filepath is None:
+            return None
+
+    if not upload_janitor.touch(working_path(filepath)):
+        with open(filepath, 'rb') as f:
+            image_data = f.read()
+        try:
+            filepath = ingest_upload(uuid, image_data)
+        except ValueError as e:
+            # Render from the stored file as it is, like before ingestion
+            logger.warning("Could not ingest the image of %s: %s", uuid, e)
+    return filepath
+
+def ensure_working(uuid):
+    """Path of the editor-resolution copy of a label's image, see ensure_upload()"""
+    filepath = ensure_upload(uuid)
+    if filepath is None:
+        return None
+    working = working_path(filepath)
+    return working if os.path.exists(working) else filepath
+
 def generate_preview_image(uuid, filepath, label_data):
-    """Generate a preview image and return its URL path"""
-    # Get design type
-    design_type = label_data.get('design_type', 'design1')
-    
-    # Select label design based on design_type
-    label_class = {
-        'design1': LabelDesign1,
-        'design2': LabelDesign2
-    }.get(design_type)
-    
-    if not label_class:
-        raise ValueError('Invalid design type')
-    
-    # Generate preview using selected design
-    generator = label_class(filepath, label_data)
-    preview_path = generator.generate_preview(uuid)
-    
-    # Ensure we have an absolute URL path starting with /uploads/
-    preview_url = '/uploads/' + os.path.basename(preview_path)
-    
-    print("preview url: " + preview_url)
+    """Generate a preview image and return the encoded bytes"""
+    # Validates design_type before handing the job to a worker
+    cache_key = preview_cache_key(uuid, label_data)
+    preview_image = render_cache.get(cache_key, disk=False)
+    if preview_image is not None:
+        return preview_image
+
+    # Generate preview using selected design, a newer request for this uuid wins.
+    # The uuid is the layer session, an edit only redraws the layers it touched.
+    preview_image = render_executor.run_latest(
+        uuid, render_preview, filepath, label_data,
+        app.config['PREVIEW_FORMAT'], app.config['PREVIEW_QUALITY'],
+        label_size(app.config['PREVIEW_SCALE']), app.config['PREVIEW_RESAMPLE'], uuid
+    )
+    # Previews are redrawn cheaply from cached layers, only PDFs are worth a file
+    return render_cache.put(cache_key, preview_image, disk=False)
+
+def preview_data_url(preview_image):
+    """Inline an encoded preview so it can travel inside a JSON response"""
+    mimetype = PREVIEW_MIMETYPES[app.config['PREVIEW_FORMAT']]
+    return f"data:{mimetype};base64,{base64.b64encode(preview_image).decode('ascii')}"
+
+def encode_cursor(cursor):
+    """Opaque pagination cursor for a (created_at, uuid) position"""
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+def decode_cursor(value):
+    if not value:
+        return None
+    try:
+        created_at, uuid = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    return created_at, uuid
 
-    return preview_url
+def list_row_to_dict(row):
+    """Convert a label list row to JSON-friendly data"""
+    return {
+        'uuid': row[0],
+        'beer_name': row[1],
+        'subtitle': row[2],
+        'abv': row[3],
+        'beer_size': row[4],
+        'description': row[5],
+        'design_type': row[6],
+        'created_at': row[7],
+        'thumbnail_url': url_for('thumbnail', thumbnail_hash=row[8]) if row[8] else None
+    }
+
+def make_thumbnail(uuid, filepath, label_data):
+    """Encoded thumbnail of a label, downscaled from its cached preview when there is one"""
+    args = (app.config['THUMBNAIL_SIZE'], app.config['THUMBNAIL_FORMAT'], app.config['THUMBNAIL_QUALITY'])
+    preview_image = render_cache.get(preview_cache_key(uuid, label_data), disk=False)
+    if preview_image is not None:
+        return encode_thumbnail(Image.open(io.BytesIO(preview_image)), *args)
+    return render_executor.run(render_thumbnail, filepath, label_data, *args)
+
+def store_thumbnail(uuid):
+    """Render and attach the thumbnail of a saved label, returning its hash or None"""
+    row = db_manager.get_beer_label_metadata(uuid)
+    if not row:
+        return None
+    filepath = ensure_working(uuid) if row[17] else None
+    try:
+        data = make_thumbnail(uuid, filepath, row_to_label_data(row))
+    except Exception as e:
+        # Best effort: the label itself is saved, `flask backfill-thumbnails` can retry later
+        logger.warning("Could not render thumbnail for %s: %r", uuid, e)
+        return None
+    return db_manager.save_thumbnail(uuid, data, PREVIEW_MIMETYPES[app.config['THUMBNAIL_FORMAT']])
 
 @app.route('/')
 def index():
-    # Get all labels from database
-    labels = db_manager.get_all_beer_labels()
-    return render_template('list.html', labels=labels)
+    # First page only, the page loads more labels and searches through /api/labels
+    labels, next_cursor = db_manager.list_beer_labels(limit=app.config['LABEL_PAGE_SIZE'])
+    return render_template('list.html', labels=[list_row_to_dict(row) for row in labels],
+                           next_cursor=encode_cursor(next_cursor),
+                           total=db_manager.count_beer_labels())
+
+@app.route('/api/labels')
+def list_labels():
+    """One page of labels: ?q=<search>&cursor=<next_cursor>&limit=<n>"""
+    try:
+        after = decode_cursor(request.args.get('cursor'))
+        limit = int(request.args.get('limit', app.config['LABEL_PAGE_SIZE']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = max(1, min(limit, app.config['LABEL_PAGE_SIZE_MAX']))
+
+    labels, next_cursor = db_manager.list_beer_labels(
+        limit=limit, after=after, query=request.args.get('q')
+    )
+    return jsonify({
+        'labels': [list_row_to_dict(row) for row in labels],
+        'next_cursor': encode_cursor(next_cursor)
+    })
+
+@app.route('/api/labels/count')
+def count_labels():
+    return jsonify({'count': db_manager.count_beer_labels(request.args.get('q'))})
+
+@app.route('/thumbnail/<thumbnail_hash>')
+def thumbnail(thumbnail_hash):
+    """Serve a stored thumbnail, its URL is its content hash so it can be cached forever"""
+    if request.if_none_match.contains(thumbnail_hash):
+        response = app.response_class(status=304)
+    else:
+        stored = db_manager.get_thumbnail(thumbnail_hash)
+        if stored is None:
+            return jsonify({'error': 'Thumbnail not found'}), 404
+        response = app.response_class(stored[0], mimetype=stored[1])
+    response.set_etag(thumbnail_hash)
+    response.headers['Cache-Control'] = f"public, max-age={app.config['THUMBNAIL_MAX_AGE']}, immutable"
+    return response
 
 @app.route('/editor/<uuid>')
 def editor(uuid):
-    # Get label data from database if it exists
-    label_data = db_manager.get_beer_label(uuid)
+    # Get label data from database if it exists, the image blob stays in the database
+    label_data = db_manager.get_beer_label_metadata(uuid)
     
     # Convert database row to dictionary if it exists
     initial_data = {}
     if label_data:
-        initial_data = {
-            'beer_name': label_data[1],
-            'subtitle': label_data[2],
-            'abv': label_data[3],
-            'beer_size': label_data[4],
-            'border_color': label_data[5],
-            'text_color': label_data[6],
-            'font': label_data[7],
-            'font_size': label_data[8],
-            'image_scale': label_data[9],
-            'image_x': label_data[10],
-            'image_y': label_data[11],
-            'crop_x': label_data[12],
-            'crop_y': label_data[13],
-            'description': label_data[14],
-            'design_type': label_data[15]
-        }
-
-        # If we have image data, save it to a temporary file and pass the URL
-        if label_data[17]:  # label_image is at index 17
-            # Use .png as default extension for the temporary file
-            temp_filename = f"{uuid}.png"
-            temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
-            
-            # Make sure we're writing bytes, not string
-            if isinstance(label_data[17], str):
-                image_data = label_data[17].encode('utf-8')
-            else:
-                image_data = label_data[17]
-                
-            with open(temp_filepath, 'wb') as f:
-                f.write(image_data)
+        initial_data = row_to_label_data(label_data)
+
+        # The browser loads the (cached) preview lazily, /image/<uuid> serves the original
+        if label_data[17]:  # image_hash is at index 17
+            initial_data['background'] = url_for('preview', uuid=uuid, **initial_data)
             
             # Add the filename to initial_data for the file input
-            initial_data['filename'] = temp_filename
-            
-            # Generate preview image
-            try:
-                preview_url = generate_preview_image(uuid, temp_filepath, initial_data)
-                initial_data['background'] = preview_url
-            except Exception as e:
-                print(f"Error generating preview: {e}")
+            initial_data['filename'] = os.path.basename(upload_path(uuid))
     
     return render_template('index.html', uuid=uuid, initial_data=initial_data)
 
+@app.route('/image/<uuid>')
+def label_image(uuid):
+    """Stream the background image of a label, honouring conditional requests"""
+    filepath = upload_path(uuid)
+    if upload_janitor.touch(filepath):
+        response = send_file(os.path.abspath(filepath), etag=stored_image_hash(uuid), conditional=True)
+    else:
+        row = db_manager.get_beer_label_metadata(uuid)
+        if not row or not row[17]:
+            return jsonify({'error': 'Label has no image'}), 404
+
+        # Stream straight from the blob store, the image hash is its ETag
+        if request.if_none_match.contains(row[17]):
+            response = app.response_class(status=304)
+        else:
+            chunks = db_manager.iter_beer_label_image(uuid)
+            first = next(chunks, b'')
+            mimetype = 'image/jpeg' if image_format(first) == 'JPEG' else 'image/png'
+            response = app.response_class(itertools.chain([first], chunks), mimetype=mimetype)
+        response.set_etag(row[17])
+
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/upload/<uuid>', methods=['POST'])
 def upload_file(uuid):
-    print("upload file")
-    print(uuid)
 
     if 'background' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
@@ -120,85 +669,225 @@ def upload_file(uuid):
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
-        filename = f"{uuid}.png"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        print (filepath)
-        # Get form data
-        label_data = {
-            'beer_name': request.form.get('beer_name', ''),
-            'subtitle': request.form.get('subtitle', ''),
-            'abv': request.form.get('abv', ''),
-            'beer_size': request.form.get('beer_size', ''),
-            'border_color': request.form.get('border_color', '#000000'),
-            'text_color': request.form.get('text_color', '#000000'),
-            'font': request.form.get('font', 'Arial'),
-            'font_size': int(request.form.get('font_size', 32)),
-            'image_scale': float(request.form.get('image_scale', 100)),
-            'image_x': float(request.form.get('image_x', 50)),
-            'image_y': float(request.form.get('image_y', 50)),
-            'crop_x': float(request.form.get('crop_x', 50)),
-            'crop_y': float(request.form.get('crop_y', 50)),
-            'description': request.form.get('description', ''),
-            'design_type': request.form.get('design_type', 'design1')
-        }
-
-        print(label_data)
+        try:
+            label_data = parse_label_data(request.form)
+            # Validated, turned upright and downscaled once, off the request thread
+            filepath = ingest_upload(uuid, file.read())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        logger.debug("Upload for %s stored at %s: %s", uuid, filepath, label_data)
         
         try:
-            preview_url = generate_preview_image(uuid, filepath, label_data)
+            preview_image = generate_preview_image(uuid, working_path(filepath), label_data)
             return jsonify({
-                'preview_url': preview_url,
-                'original_file': filename
+                'preview_url': preview_data_url(preview_image),
+                'original_file': os.path.basename(filepath),
+                'image_hash': stored_image_hash(uuid)
             })
+        except RenderSuperseded as e:
+            # The upload is stored, only its preview lost to a newer one
+            return jsonify({
+                'error': str(e),
+                'superseded': True,
+                'original_file': os.path.basename(filepath),
+                'image_hash': stored_image_hash(uuid)
+            }), 409
+        except RenderError:
+            raise
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
     return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/preview/<uuid>', methods=['GET', 'POST'])
+def preview(uuid):
+    """Render a preview from label parameters against the already uploaded image.
+
+    Parameters come as JSON (POST) or query string (GET), the image bytes are
+    returned directly.
+    """
+    filepath = ensure_working(uuid)
+    if not filepath:
+        return jsonify({'error': 'No image uploaded for this label'}), 404
+
+    try:
+        if request.method == 'POST':
+            label_data = parse_label_data(request.get_json(silent=True) or {})
+        else:
+            label_data = parse_label_data(request.args)
+        etag = preview_etag(uuid, label_data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        try:
+            preview_image = generate_preview_image(uuid, filepath, label_data)
+        except RenderError:
+            raise
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        response = app.response_class(preview_image, mimetype=PREVIEW_MIMETYPES[app.config['PREVIEW_FORMAT']])
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/generate-pdf/<uuid>', methods=['POST'])
 def generate_pdf(uuid):
-    print("generate pdf")
-    print(request.form)
-    label_data = json.loads(request.form.get('label_data'))
-    design_type = label_data.get('design_type', 'design1')  # Add design type parameter
-
-    print("design_type: ", design_type)
+    raw_label_data = json.loads(request.form.get('label_data'))
+    try:
+        label_data = parse_label_data(raw_label_data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    design_type = label_data['design_type']
 
     # Select label design based on design_type
-    label_class = {
-        'design1': LabelDesign1,
-        'design2': LabelDesign2
-    }.get(design_type)
-    
-    if not label_class:
-        return jsonify({'error': 'Invalid design type'}), 400
+    try:
+        design = get_design(design_type)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    bottle_size = label_data.get('beer_size', '500ML')
-    beer_name = label_data.get('beer_name', 'Beer Name')
+    bottle_size = label_data['beer_size']
+    beer_name = raw_label_data.get('beer_name', 'Beer Name')
 
-    print("beer_name: ", beer_name)
-    print("bottle_size: ", bottle_size)
+    logger.debug("PDF for %s: %s, %s, %s", uuid, design_type, beer_name, bottle_size)
 
-    temp_filename = f"{uuid}.png"
-    temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
+    temp_filepath = ensure_upload(uuid)
 
-    generator = label_class(temp_filepath, label_data)
+    try:
+        print_size = PDFGenerator().pixel_size(bottle_size, app.config['PDF_DPI'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    #uuid = label_data.get('uuid')
-    pdf_path = generator.generate_pdf(uuid, beer_name, bottle_size=bottle_size)
-    
+    # Reprints of an unchanged label are a cache lookup
+    cache_key = render_cache.make_key(
+        'pdf', design.key, label_data, stored_image_hash(uuid), print_size,
+        bottle_size=bottle_size, vector_text=app.config['PDF_VECTOR_TEXT'], fonts=FONTS_DIGEST
+    )
+    pdf_data = render_cache.get(cache_key)
+    if pdf_data is None:
+        # Built in memory, concurrent requests for the same beer never share a file
+        pdf_data = render_cache.put(cache_key, render_executor.run(
+            render_pdf, temp_filepath, label_data, bottle_size,
+            app.config['PDF_DPI'], app.config['PDF_VECTOR_TEXT']
+        ))
+
+    return send_file(io.BytesIO(pdf_data), mimetype='application/pdf', as_attachment=True,
+                     download_name=f"{secure_filename(beer_name) or 'beer_label'}.pdf")
+
+@app.route('/generate-batch-pdf', methods=['POST'])
+def generate_batch_pdf():
+    """Print sheets for a production run: {"items": [{"uuid", "quantity"}], "bottle_size"}"""
+    request_data = request.get_json(silent=True) or {}
+    if not isinstance(request_data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    items = request_data.get('items') or []
+    bottle_size = request_data.get('bottle_size', '500ML')
+
+    if not items:
+        return jsonify({'error': 'No labels requested'}), 400
+    if not isinstance(items, list) or not all(
+        isinstance(item, dict) and isinstance(item.get('uuid'), str) for item in items
+    ):
+        return jsonify({'error': 'items must be a list of objects with a string uuid'}), 400
+
+    try:
+        print_size = PDFGenerator().pixel_size(bottle_size, app.config['PDF_DPI'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # One query for the whole run
+    rows = {row[0]: row for row in db_manager.get_many(item.get('uuid') for item in items)}
+
+    jobs = []
+    total = 0
+    for item in items:
+        uuid = item.get('uuid')
+        try:
+            quantity = int(item.get('quantity', 1))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity < 1:
+            return jsonify({'error': f'Invalid quantity for label {uuid}'}), 400
+        if quantity > app.config['BATCH_MAX_QUANTITY']:
+            return jsonify({
+                'error': f"Quantity for label {uuid} is over the limit of {app.config['BATCH_MAX_QUANTITY']}"
+            }), 400
+        total += quantity
+        if total > app.config['BATCH_MAX_LABELS']:
+            return jsonify({
+                'error': f"Too many labels, one batch prints at most {app.config['BATCH_MAX_LABELS']}"
+            }), 400
+
+        row = rows.get(uuid)
+        if not row:
+            return jsonify({'error': f'Label not found: {uuid}'}), 404
+
+        try:
+            # Labels saved before save-label validated may hold anything
+            label_data = parse_label_data(row_to_label_data(row))
+            get_design(label_data['design_type'])
+        except ValueError as e:
+            return jsonify({'error': f'Label {uuid}: {e}'}), 400
 
-    print("pdf_path: ", pdf_path)
+        filepath = ensure_upload(uuid) if row[17] else None
+        jobs.append((label_data, filepath, quantity))
 
-    return send_file(pdf_path, as_attachment=True, download_name='beer_label.pdf')
+    logger.info("Batch PDF for %d labels", len(jobs))
+
+    # Render labels in parallel on the render workers, the PDF lays out pages as results arrive in order
+    rendered = render_executor.map(
+        render_print_label,
+        [filepath for _, filepath, _ in jobs],
+        [label_data for label_data, _, _ in jobs],
+        itertools.repeat(print_size),
+        itertools.repeat(app.config['PDF_VECTOR_TEXT'])
+    )
+    labels = (
+        (label_data['beer_name'], label_image, quantity)
+        for (label_data, _, quantity), label_image in zip(jobs, rendered)
+    )
+
+    # Kept in memory up to PDF_SPOOL_BYTES, larger runs spill to a private temporary file
+    output = tempfile.SpooledTemporaryFile(max_size=app.config['PDF_SPOOL_BYTES'])
+    try:
+        PDFGenerator().generate_batch_pdf(output, labels, bottle_size=bottle_size)
+    except ValueError as e:
+        output.close()
+        return jsonify({'error': str(e)}), 400
+    output.seek(0)
+
+    return send_file(output, mimetype='application/pdf', as_attachment=True,
+                     download_name='beer_labels.pdf')
+
+@app.route('/render-stats')
+def render_stats():
+    """Render queue depth, worker utilisation and cache counters"""
+    return jsonify({
+        'executor': render_executor.stats(),
+        'image_cache': worker_cache_stats('image_cache'),
+        'layer_cache': worker_cache_stats('layer_cache'),
+        'fonts': worker_fonts(),
+        'render_cache': render_cache.stats(),
+        'upload_janitor': upload_janitor.stats()
+    })
 
 @app.route('/save-label/<uuid>', methods=['POST'])
 def save_label(uuid):
     try:
-        # Get label data from form
-        label_data = json.loads(request.form.get('label_data'))
-        
+        # Get label data from form, validated before anything is written
+        try:
+            if not request.form.get('label_data'):
+                raise ValueError('No label data provided')
+            raw_label_data = json.loads(request.form['label_data'])
+            if not isinstance(raw_label_data, dict):
+                raise ValueError('Invalid label data')
+            label_data = parse_label_data(raw_label_data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         # Get the background file if it exists
         background_file = None
         if 'background' in request.files:
@@ -207,39 +896,94 @@ def save_label(uuid):
         # If we have a file, read it into binary data
         image_data = None
         if background_file and background_file.filename:
-            image_data = background_file.read()
+            # The thumbnail is rendered from the upload folder
+            try:
+                ingest_upload(uuid, background_file.read())
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        if os.path.exists(upload_path(uuid)):
+            # The database keeps the ingested master; only send it if it
+            # changed since the last save, otherwise the label keeps its image
+            row = db_manager.get_beer_label_metadata(uuid)
+            if not row or row[17] != stored_image_hash(uuid):
+                with open(upload_path(uuid), 'rb') as f:
+                    image_data = f.read()
         
         # Save to database
         success = db_manager.save_beer_label(
             uuid=uuid,
-            beer_name=label_data.get('beer_name', ''),
-            subtitle=label_data.get('subtitle', ''),
-            abv=label_data.get('abv', ''),
-            beer_size=label_data.get('beer_size', ''),
-            border_color=label_data.get('border_color', '#000000'),
-            text_color=label_data.get('text_color', '#000000'),
-            font=label_data.get('font', 'Arial'),
-            font_size=label_data.get('font_size', 32),
-            image_scale=label_data.get('image_scale', 100),
-            image_x=label_data.get('image_x', 50),
-            image_y=label_data.get('image_y', 50),
-            crop_x=label_data.get('crop_x', 50),
-            crop_y=label_data.get('crop_y', 50),
-            description=label_data.get('description', ''),
-            design_type=label_data.get('design_type', 'design1'),
+            beer_name=label_data['beer_name'],
+            subtitle=label_data['subtitle'],
+            abv=label_data['abv'],
+            beer_size=label_data['beer_size'],
+            border_color=label_data['border_color'],
+            text_color=label_data['text_color'],
+            font=label_data['font'],
+            font_size=label_data['font_size'],
+            image_scale=label_data['image_scale'],
+            image_x=label_data['image_x'],
+            image_y=label_data['image_y'],
+            crop_x=label_data['crop_x'],
+            crop_y=label_data['crop_y'],
+            description=label_data['description'],
+            design_type=label_data['design_type'],
             image_data=image_data
         )
         
         if success:
+            # Rendered now so browsing the list never has to render a label
+            store_thumbnail(uuid)
             return jsonify({'message': 'Label saved successfully'})
         else:
             return jsonify({'error': 'Failed to save label'}), 500
             
     except Exception as e:
-        print(f"Error saving label: {e}")
+        logger.exception("Error saving label %s", uuid)
         return jsonify({'error': str(e)}), 500
 
+@app.cli.command('backfill-thumbnails')
+@click.option('--all', 'regenerate', is_flag=True, help='Regenerate every thumbnail, not only missing ones.')
+def backfill_thumbnails(regenerate):
+    """Generate list page thumbnails for labels saved before they existed"""
+    rows = db_manager.get_labels_for_thumbnails(missing_only=not regenerate)
+    print(f"Generating {len(rows)} thumbnails")
+
+    args = (app.config['THUMBNAIL_SIZE'], app.config['THUMBNAIL_FORMAT'], app.config['THUMBNAIL_QUALITY'])
+    mimetype = PREVIEW_MIMETYPES[app.config['THUMBNAIL_FORMAT']]
+    window = render_executor.max_workers * 2
+    done = failed = 0
+    # Keep a few jobs per worker in flight, a broken label must not stop the run
+    for start in range(0, len(rows), window):
+        jobs = []
+        for row in rows[start:start + window]:
+            filepath = ensure_working(row[0]) if row[17] else None
+            future = render_executor.submit(render_thumbnail, filepath, row_to_label_data(row), *args, block=True)
+            jobs.append((row[0], future))
+        for uuid, future in jobs:
+            try:
+                data = render_executor.result(future)
+            except Exception as e:
+                print(f"Could not render thumbnail for {uuid}: {e}")
+                failed += 1
+                continue
+            if db_manager.save_thumbnail(uuid, data, mimetype):
+                done += 1
+            else:
+                failed += 1
+
+    print(f"Generated {done} thumbnails, {failed} failed")
+    render_executor.shutdown()
+
+@app.cli.command('clean-uploads')
+def clean_uploads():
+    """Delete stale uploads and enforce the upload folder quota once, e.g. from cron"""
+    result = upload_janitor.sweep()
+    print(f"Removed {result['files_removed']} files, reclaimed {result['bytes_reclaimed']} bytes, "
+          f"{result['bytes_stored']} bytes remain")
+    render_executor.shutdown()
+
 if __name__ == '__main__':
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     init_db()  # Initialize database on startup
+    render_executor.warm_up()
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""ASGI entry point, the async serving mode:
+
+    LABELIZER_SERVER=asgi gunicorn          # settings from gunicorn.conf.py
+    uvicorn asgi:application --timeout-keep-alive 5
+
+Connections are handled on an event loop and the Flask views on a bounded
+thread pool by a2wsgi's WSGIMiddleware. Request bodies are received on the
+event loop before a view gets a thread, so slow uploads don't hold one. The
+render workers start and stop with the ASGI lifespan.
+"""
+import asyncio
+import logging
+
+from a2wsgi import WSGIMiddleware
+
+from app import app, render_executor, upload_janitor
+
+logger = logging.getLogger(__name__)
+
+# Worker processes start before the first request, not during it
+ON_STARTUP = [render_executor.warm_up]
+ON_SHUTDOWN = [upload_janitor.stop, render_executor.shutdown]
+
+wsgi = WSGIMiddleware(app, workers=app.config['ASGI_THREADS'])
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                for hook in ON_STARTUP:
+                    await asyncio.to_thread(hook)
+            except Exception as e:
+                logger.exception("Startup failed")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for hook in ON_SHUTDOWN:
+                try:
+                    await asyncio.to_thread(hook)
+                except Exception:
+                    logger.exception("Shutdown hook %r failed", hook)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def buffered(receive, send, max_body):
+    """Receive the whole request body and return a receive callable replaying it.
+
+    Returns None when the client left or the body was over max_body, which
+    is answered with 413 here.
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > max_body:
+            await send({'type': 'http.response.start', 'status': 413,
+                        'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+            await send({'type': 'http.response.body', 'body': b'Request Entity Too Large'})
+            return None
+        if not message.get('more_body', False):
+            break
+
+    async def replay():
+        nonlocal body
+        if body is None:
+            # The app reads past the body only to wait for a disconnect
+            return await receive()
+        message = {'type': 'http.request', 'body': bytes(body), 'more_body': False}
+        body = None
+        return message
+    return replay
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http':
+        receive = await buffered(receive, send, app.config['MAX_CONTENT_LENGTH'])
+        if receive is not None:
+            await wsgi(scope, receive, send)
+    else:
+        await wsgi(scope, receive, send)
@@ -0,0 +1,137 @@
+"""Run the benchmark suites, write the results as JSON and compare them against a baseline.
+
+Run from the repository root:
+
+    python -m bench [SUITE ...] [--repeat N] [--output FILE] [--baseline FILE] [--threshold RATIO]
+
+Without suites every suite runs. Save the output of a run on the deployed
+version and pass it as --baseline on the next one: every time and size
+that grew by more than the threshold is reported as a regression and the
+exit status is 1. Progress messages of the app go to stderr, stdout only
+carries the JSON.
+"""
+import argparse
+from contextlib import redirect_stdout
+import datetime
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import PIL
+import reportlab
+
+try:
+    import numpy as np
+except ImportError:  # optional, only the compositing suite needs it
+    np = None
+
+# Suite name -> bench module, each has run(repeat=...)
+SUITES = {
+    'render': 'bench.render_modes',
+    'pdf': 'bench.pdf_reuse',
+    'pdf_text': 'bench.pdf_text',
+    'compositing': 'bench.compositing',
+    'layers': 'bench.layers',
+    'db': 'bench.db',
+    'flask': 'bench.flask_app'
+}
+
+# Timing differences below this are noise, whatever the ratio
+NOISE_SECONDS = 0.0005
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    """What the numbers depend on besides the code"""
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'pillow': PIL.__version__,
+        'reportlab': reportlab.Version,
+        'numpy': np.__version__ if np is not None else None
+    }
+
+def metrics(results, prefix=''):
+    """Flatten suite results to {'suite.key.seconds': value} for the times and sizes in them"""
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(metrics(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) \
+                and (key.endswith('seconds') or key.endswith('bytes')):
+            flat[name] = value
+    return flat
+
+def compare(current, baseline, threshold):
+    """Relative change of every metric both runs have, and which of them regressed"""
+    current, baseline = metrics(current), metrics(baseline)
+    changes = {}
+    regressions = []
+    for name in sorted(current.keys() & baseline.keys()):
+        before, after = baseline[name], current[name]
+        if not before:
+            continue
+        change = after / before - 1
+        changes[name] = {'baseline': before, 'current': after, 'change': change}
+        noise = name.endswith('seconds') and abs(after - before) < NOISE_SECONDS
+        if change > threshold and not noise:
+            regressions.append(name)
+    return {'threshold': threshold, 'changes': changes, 'regressions': regressions}
+
+def run_suite(name, repeat):
+    if name == 'compositing' and np is None:
+        return {'skipped': 'numpy is not installed'}
+    module = importlib.import_module(SUITES[name])
+    kwargs = {'repeat': repeat} if repeat else {}
+    with redirect_stdout(sys.stderr):
+        return module.run(**kwargs)
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__.splitlines()[0])
+    parser.add_argument('suites', nargs='*', metavar='SUITE',
+                        help=f"suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument('--repeat', type=int, help='repetitions per measurement (default: per suite)')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='relative growth reported as a regression (default: 0.15)')
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    results = {'environment': environment(), 'suites': {}}
+    for name in args.suites or SUITES:
+        print(f"Running {name}", file=sys.stderr)
+        results['suites'][name] = run_suite(name, args.repeat)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results['comparison'] = compare(results['suites'], baseline['suites'], args.threshold)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if results.get('comparison', {}).get('regressions'):
+        print(f"Regressions: {', '.join(results['comparison']['regressions'])}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
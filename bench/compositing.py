@@ -0,0 +1,91 @@
+"""Check that the numpy compositing engine matches the pillow engine pixel for pixel, and time both.
+
+Run from the repository root (needs numpy):
+
+    python -m bench.compositing [--repeat N]
+
+Exits with status 1 when any case differs.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from bench.pdf_reuse import LABEL_DATA, make_background
+from labels.compositing import compositor
+from labels.image_cache import image_cache
+from labels.label_design import LabelDesign
+
+# Label variants covering every branch of the layout
+CASES = {
+    'default': {},
+    'colours': {'text_color': '#3366cc', 'border_color': 'red'},
+    'large_font': {'font_size': 60, 'font': 'Verdana'},
+    'empty_name': {'beer_name': '', 'subtitle': ''},
+    'cropped': {'crop_x': 0, 'crop_y': 100, 'image_x': 20, 'image_y': 80},
+    'design2': {'design_type': 'design2', 'text_color': '#3366cc'}
+}
+
+SIZES = {'bottle': (540, 600), 'keg': (600, 540)}
+
+def render(image_path, label_data, size, engine):
+    compositor.configure(engine)
+    return LabelDesign(image_path, label_data).render(size)
+
+def differing_pixels(a, b):
+    return sum(1 for x, y in zip(a.getdata(), b.getdata()) if x != y)
+
+def time_engine(image_path, engine, repeat):
+    compositor.configure(engine)
+    design = LabelDesign(image_path, LABEL_DATA)
+    design.render(SIZES['bottle'])
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        design.render(SIZES['bottle'])
+        timings.append(time.perf_counter() - start)
+    return {'render_seconds': min(timings)}
+
+def run(repeat=20):
+    results = {'equivalent': True, 'cases': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        backgrounds = {'none': None}
+        for mode in ('RGB', 'RGBA', 'P'):
+            path = os.path.join(tmp, f'background_{mode}.png')
+            make_background(path, (1600, 1200))
+            Image.open(path).convert(mode).save(path)
+            backgrounds[mode] = path
+
+        for background, path in backgrounds.items():
+            for case, overrides in CASES.items():
+                label_data = dict(LABEL_DATA, **overrides)
+                for size_name, size in SIZES.items():
+                    expected = render(path, label_data, size, 'pillow')
+                    actual = render(path, label_data, size, 'numpy')
+                    name = f'{background}/{case}/{size_name}'
+                    differing = differing_pixels(expected, actual)
+                    results['cases'][name] = differing
+                    if differing:
+                        results['equivalent'] = False
+
+        image_cache.clear()
+        for engine in ('pillow', 'numpy'):
+            results[engine] = time_engine(backgrounds['RGB'], engine, repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    results = run(args.repeat)
+    print(json.dumps(results, indent=2))
+    if not results['equivalent']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Time DBManager saves, lookups and list pages on a database holding camera-sized image blobs.
+
+Run from the repository root:
+
+    python -m bench.db [--repeat N] [--labels N] [--blob-bytes N]
+
+The database is created in a temporary directory, the repository's own
+database is never touched.
+"""
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import tempfile
+
+from bench.pdf_reuse import LABEL_DATA, time_call
+from database.db_manager import DBManager
+from database.schema import init_db
+
+# Distinct images, labels beyond this share them like reprinted designs do
+IMAGES = 10
+
+@contextmanager
+def workdir(path):
+    """Run the block with path as the working directory, the app uses relative paths"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+
+def label_row(index, image_data):
+    return dict(
+        LABEL_DATA,
+        uuid=f'bench-{index:05d}',
+        beer_name=f"{LABEL_DATA['beer_name']} {index}",
+        image_scale=100, image_x=50, image_y=50, crop_x=50, crop_y=50,
+        description='Bench label', design_type='design1',
+        image_data=image_data
+    )
+
+def run(repeat=20, labels=100, blob_bytes=3 * 1024 * 1024):
+    results = {'labels': labels, 'blob_bytes': blob_bytes}
+    with tempfile.TemporaryDirectory() as tmp, workdir(tmp):
+        init_db()
+        db = DBManager()
+        # Random bytes do not compress, like photo uploads
+        images = [os.urandom(blob_bytes) for _ in range(IMAGES)]
+
+        counter = iter(range(labels, 10 ** 9))
+        results['save_new_image_seconds'], _ = time_call(
+            lambda: db.save_beer_label(**label_row(next(counter), os.urandom(blob_bytes))), repeat
+        )
+        results['save_many_seconds'], _ = time_call(
+            lambda: db.save_many([label_row(i, images[i % IMAGES]) for i in range(labels)]), 1
+        )
+        results['save_same_image_seconds'], _ = time_call(
+            lambda: db.save_beer_label(**label_row(0, images[0])), repeat
+        )
+        results['save_metadata_seconds'], _ = time_call(
+            lambda: db.save_beer_label(**label_row(0, None)), repeat
+        )
+
+        uuid = label_row(labels // 2, None)['uuid']
+        results['get_metadata_seconds'], _ = time_call(lambda: db.get_beer_label_metadata(uuid), repeat)
+        results['get_image_seconds'], _ = time_call(lambda: db.get_beer_label_image(uuid), repeat)
+        results['get_many_seconds'], _ = time_call(
+            lambda: db.get_many(label_row(i, None)['uuid'] for i in range(0, labels, 2)), repeat
+        )
+
+        rows, cursor = db.list_beer_labels(limit=50)
+        results['list_first_page_seconds'], _ = time_call(lambda: db.list_beer_labels(limit=50), repeat)
+        results['list_next_page_seconds'], _ = time_call(
+            lambda: db.list_beer_labels(limit=50, after=cursor), repeat
+        )
+        results['list_search_seconds'], _ = time_call(
+            lambda: db.list_beer_labels(limit=50, query='Sunset 4'), repeat
+        )
+        results['count_seconds'], _ = time_call(db.count_beer_labels, repeat)
+
+        db.close()
+        results['database_bytes'] = sum(
+            os.path.getsize(os.path.join('database', name)) for name in os.listdir('database')
+        )
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--labels', type=int, default=100)
+    parser.add_argument('--blob-bytes', type=int, default=3 * 1024 * 1024)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat, args.labels, args.blob_bytes), indent=2))
+
+if __name__ == '__main__':
+    main()
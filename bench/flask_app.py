@@ -0,0 +1,86 @@
+"""Time /upload, /preview and /generate-pdf end to end through the Flask test client.
+
+Run from the repository root:
+
+    python -m bench.flask_app [--repeat N]
+
+The app runs in a temporary directory with its own database, uploads and
+render cache. Cold timings change the label every request so the render
+cache misses, cached timings repeat one request.
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+
+from bench.db import workdir
+from bench.pdf_reuse import LABEL_DATA, make_background, time_call
+
+def run(repeat=5):
+    results = {}
+    # Resolved before leaving the repository root
+    os.environ.setdefault('LABELIZER_FONT_DIR', os.path.abspath('fonts'))
+    os.environ.setdefault('LABELIZER_UPLOAD_JANITOR', 'cli')
+
+    with tempfile.TemporaryDirectory() as tmp, workdir(tmp):
+        make_background('background.png')
+        with open('background.png', 'rb') as f:
+            image_data = f.read()
+        results['upload_bytes'] = len(image_data)
+
+        # The app creates its database and folders relative to the working directory
+        import app as labelizer
+        client = labelizer.app.test_client()
+        labelizer.render_executor.warm_up()
+
+        counter = iter(range(10 ** 9))
+
+        def upload(uuid, beer_name):
+            response = client.post(f'/upload/{uuid}', data=dict(
+                LABEL_DATA, beer_name=beer_name,
+                background=(io.BytesIO(image_data), 'background.png')
+            ))
+            assert response.status_code == 200, response.get_data(as_text=True)
+            return response
+
+        def generate_pdf(beer_name):
+            response = client.post('/generate-pdf/bench', data={
+                'label_data': json.dumps(dict(LABEL_DATA, beer_name=beer_name))
+            })
+            assert response.status_code == 200, response.get_data(as_text=True)
+            return response
+
+        def preview(beer_name):
+            response = client.get('/preview/bench', query_string=dict(LABEL_DATA, beer_name=beer_name))
+            assert response.status_code == 200, response.get_data(as_text=True)
+            return response
+
+        results['upload_cold_seconds'], _ = time_call(
+            lambda: upload(f'bench-{next(counter)}', f'Bench {next(counter)}'), repeat
+        )
+        upload('bench', 'Bench')
+        results['upload_cached_seconds'], _ = time_call(lambda: upload('bench', 'Bench'), repeat)
+
+        results['preview_cold_seconds'], response = time_call(lambda: preview(f'Bench {next(counter)}'), repeat)
+        results['preview_bytes'] = len(response.data)
+        results['preview_cached_seconds'], _ = time_call(lambda: preview('Bench'), repeat)
+
+        results['generate_pdf_cold_seconds'], response = time_call(
+            lambda: generate_pdf(f'Bench {next(counter)}'), repeat
+        )
+        results['pdf_bytes'] = len(response.data)
+        results['generate_pdf_cached_seconds'], _ = time_call(lambda: generate_pdf('Bench'), repeat)
+
+        labelizer.render_executor.shutdown()
+        labelizer.db_manager.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+if __name__ == '__main__':
+    main()
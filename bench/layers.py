@@ -0,0 +1,94 @@
+"""Time preview re-renders after a single edit, with and without a layer session.
+
+Run from the repository root:
+
+    python -m bench.layers [--repeat N]
+
+Each edit toggles one field between two values, as a user trying colours
+would. With a session only the layers depending on that field are redrawn.
+Every session render is also compared with a render from scratch, the exit
+status is 1 when any differs.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.pdf_reuse import LABEL_DATA, make_background
+from labels.compositing import compositor
+from labels.image_cache import image_cache
+from labels.label_design import LabelDesign
+from labels.layer_cache import layer_cache
+
+try:
+    import numpy
+except ImportError:  # optional, only the numpy engine needs it
+    numpy = None
+
+# Edit -> the two values of the field it toggles
+EDITS = {
+    'text_color': {'text_color': ('#ffffff', '#3366cc')},
+    'beer_name': {'beer_name': ('Sample IPA', 'Sample Stout')},
+    'border_color': {'border_color': ('black', 'red')},
+    'crop': {'crop_x': (50, 30)}
+}
+
+SIZE = (540, 600)
+
+def edits(edit, count):
+    """count variants of LABEL_DATA alternating between the edit's values"""
+    (field, values), = EDITS[edit].items()
+    return [dict(LABEL_DATA, **{field: values[i % 2]}) for i in range(count)]
+
+def time_renders(image_path, variants, session):
+    timings = []
+    images = []
+    for label_data in variants:
+        start = time.perf_counter()
+        images.append(LabelDesign(image_path, label_data).render(SIZE, session=session))
+        timings.append(time.perf_counter() - start)
+    # The first render of a session draws every layer
+    return min(timings[1:]), images
+
+def run(repeat=20):
+    engines = ['pillow'] + (['numpy'] if numpy is not None else [])
+    results = {'equivalent': True, 'engines': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'background.png')
+        make_background(path, (1600, 1200))
+
+        for engine in engines:
+            compositor.configure(engine)
+            engine_results = results['engines'][engine] = {}
+            for edit in EDITS:
+                variants = edits(edit, repeat + 1)
+                image_cache.clear()
+                layer_cache.clear()
+                full_seconds, expected = time_renders(path, variants, None)
+                session_seconds, actual = time_renders(path, variants, 'bench')
+                equivalent = all(a.tobytes() == b.tobytes() for a, b in zip(expected, actual))
+                if not equivalent:
+                    results['equivalent'] = False
+                engine_results[edit] = {
+                    'full_seconds': full_seconds,
+                    'session_seconds': session_seconds,
+                    'speedup': full_seconds / session_seconds,
+                    'equivalent': equivalent
+                }
+    compositor.configure('pillow')
+    results['layer_cache'] = layer_cache.stats()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    results = run(args.repeat)
+    print(json.dumps(results, indent=2))
+    if not results['equivalent']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""Load-test the app served by the dev server, threaded gunicorn and the ASGI mode.
+
+Run from the repository root (the wsgi and asgi servers need the server packages
+from requirements.txt):
+
+    python -m bench.load_test [--servers dev wsgi asgi] [--editors N] [--duration S]
+                              [--slow-clients N] [--url URL]
+
+Each server is started in a temporary directory with its own database and
+uploads. Every simulated editor uploads a background, then keeps asking for
+previews with a changed beer name (so the render cache misses), now and then
+lists the labels or builds a PDF. Slow clients trickle uploads meanwhile,
+like editors on a poor connection. With --url an already running server is
+tested instead. The results are printed as JSON, with throughput and
+latency relative to the dev server.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from PIL import Image
+
+from bench.pdf_reuse import LABEL_DATA, make_background
+
+# Share of each editor request, the rest are previews
+LIST_SHARE = 0.15
+PDF_SHARE = 0.05
+
+SLOW_CHUNK_BYTES = 32 * 1024
+SLOW_CHUNK_INTERVAL = 0.25  # seconds between chunks, 128 KB/s per client
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def server_command(server, port):
+    if server == 'dev':
+        # What python app.py runs, on another port
+        return [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--debug', '--port', str(port)]
+    return [sys.executable, '-m', 'gunicorn', '-c', os.path.abspath('gunicorn.conf.py')]
+
+def start_server(server, port, workdir):
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.abspath('.'),
+        LABELIZER_FONT_DIR=os.environ.get('LABELIZER_FONT_DIR', os.path.abspath('fonts')),
+        LABELIZER_UPLOAD_JANITOR='cli',
+        LABELIZER_SERVER=server,
+        LABELIZER_BIND=f'127.0.0.1:{port}'
+    )
+    os.makedirs(os.path.join(workdir, 'static', 'uploads'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'database'), exist_ok=True)
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    # Own session, so the reloader's child and gunicorn's workers stop with it
+    return subprocess.Popen(server_command(server, port), cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+def wait_until_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, _ = Client(url).request('GET', '/api/labels/count')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f'Server at {url} did not start')
+
+def multipart(fields, files):
+    """Encode a multipart/form-data body, files maps a field to (filename, bytes)"""
+    boundary = f'----labelizer{random.getrandbits(64):x}'
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                   f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+        body.write(data)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return f'multipart/form-data; boundary={boundary}', body.getvalue()
+
+class Client:
+    """One keep-alive connection, reopened after errors"""
+
+    def __init__(self, url, timeout=60):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self.connection.request(method, path, body=body, headers=headers or {})
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def upload(client, uuid, image_data):
+    content_type, body = multipart(dict(LABEL_DATA, beer_name=uuid), {'background': ('background.jpg', image_data)})
+    # Every editor starts at once, uploads wait out a full render queue
+    while client.request('POST', f'/upload/{uuid}', body, {'Content-Type': content_type})[0] == 503:
+        time.sleep(random.uniform(0.5, 1.5))
+
+def editor(client, uuid, deadline, results, lock):
+    counter = 0
+    while time.monotonic() < deadline:
+        counter += 1
+        label_data = dict(LABEL_DATA, beer_name=f'{uuid} {counter}')
+        draw = random.random()
+        if draw < LIST_SHARE:
+            action, request = 'list', ('GET', '/api/labels', None, {})
+        elif draw < LIST_SHARE + PDF_SHARE:
+            action, request = 'pdf', ('POST', f'/generate-pdf/{uuid}',
+                                      urllib.parse.urlencode({'label_data': json.dumps(label_data)}),
+                                      {'Content-Type': 'application/x-www-form-urlencoded'})
+        else:
+            action, request = 'preview', ('POST', f'/preview/{uuid}', json.dumps(label_data),
+                                          {'Content-Type': 'application/json'})
+
+        start = time.perf_counter()
+        try:
+            status, _ = client.request(*request)
+        except OSError:
+            status = 'error'
+        elapsed = time.perf_counter() - start
+        with lock:
+            results.append((action, status, elapsed))
+
+def slow_client(url, uuid, image_data, deadline, results, lock):
+    """Upload over and over at SLOW_CHUNK_BYTES per SLOW_CHUNK_INTERVAL"""
+    parsed = urllib.parse.urlsplit(url)
+    content_type, body = multipart(dict(LABEL_DATA, beer_name=uuid), {'background': ('background.jpg', image_data)})
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((parsed.hostname, parsed.port or 80), timeout=60) as sock:
+                sock.sendall(
+                    f'POST /upload/{uuid} HTTP/1.1\r\nHost: {parsed.netloc}\r\n'
+                    f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n'
+                    f'Connection: close\r\n\r\n'.encode()
+                )
+                for offset in range(0, len(body), SLOW_CHUNK_BYTES):
+                    sock.sendall(body[offset:offset + SLOW_CHUNK_BYTES])
+                    time.sleep(SLOW_CHUNK_INTERVAL)
+                status = int(sock.recv(64).split(b' ', 2)[1])
+        except (OSError, ValueError, IndexError):
+            status = 'error'
+        with lock:
+            results.append(('slow_upload', status, time.perf_counter() - start))
+
+def load(url, editors, duration, slow_clients, image_data):
+    results = []
+    lock = threading.Lock()
+    clients = {f'load-{i}': Client(url) for i in range(editors)}
+    uploads = [threading.Thread(target=upload, args=(client, uuid, image_data)) for uuid, client in clients.items()]
+    for thread in uploads:
+        thread.start()
+    for thread in uploads:
+        thread.join()
+
+    deadline = time.monotonic() + duration
+    editor_threads = [
+        threading.Thread(target=editor, args=(client, uuid, deadline, results, lock))
+        for uuid, client in clients.items()
+    ]
+    slow_threads = [
+        threading.Thread(target=slow_client, args=(url, f'slow-{i}', image_data, deadline, results, lock))
+        for i in range(slow_clients)
+    ]
+    start = time.perf_counter()
+    for thread in editor_threads + slow_threads:
+        thread.start()
+    for thread in editor_threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for thread in slow_threads:
+        thread.join()
+
+    summary = {'seconds': elapsed, 'actions': {}}
+    for action in ('preview', 'list', 'pdf', 'slow_upload'):
+        rows = [(status, seconds) for name, status, seconds in results if name == action]
+        if not rows:
+            continue
+        statuses = {}
+        for status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        ok = [seconds for status, seconds in rows if status == 200]
+        summary['actions'][action] = {
+            'requests': len(rows),
+            'statuses': statuses,
+            'p50_seconds': percentile(ok, 0.5),
+            'p95_seconds': percentile(ok, 0.95),
+            'p99_seconds': percentile(ok, 0.99)
+        }
+    # Renders are the work that counts, a 503 answers fast but the editor sees no preview
+    rendered = [seconds for name, status, seconds in results if name in ('preview', 'pdf') and status == 200]
+    summary['renders_per_second'] = len(rendered) / elapsed
+    summary['render_p95_seconds'] = percentile(rendered, 0.95)
+    summary['rejected'] = sum(1 for _, status, _ in results if status == 503)
+    return summary
+
+def run(servers=('dev', 'wsgi', 'asgi'), editors=32, duration=20, slow_clients=8, url=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'background.png')
+        # About 800 KB as JPEG, noise barely compresses
+        make_background(path, (1200, 900))
+        output = io.BytesIO()
+        Image.open(path).save(output, format='JPEG', quality=90)
+        image_data = output.getvalue()
+
+        if url:
+            return {'url': url, 'result': load(url, editors, duration, slow_clients, image_data)}
+
+        results = {'editors': editors, 'slow_clients': slow_clients, 'servers': {}}
+        for server in servers:
+            port = free_port()
+            workdir = os.path.join(tmp, server)
+            process = start_server(server, port, workdir)
+            try:
+                server_url = f'http://127.0.0.1:{port}'
+                wait_until_ready(server_url)
+                results['servers'][server] = load(server_url, editors, duration, slow_clients, image_data)
+            finally:
+                stop_server(process)
+
+        baseline = results['servers'].get('dev')
+        if baseline:
+            for result in results['servers'].values():
+                if baseline['renders_per_second']:
+                    result['renders_vs_dev'] = result['renders_per_second'] / baseline['renders_per_second']
+                if result['render_p95_seconds'] and baseline['render_p95_seconds']:
+                    result['render_p95_vs_dev'] = result['render_p95_seconds'] / baseline['render_p95_seconds']
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', nargs='+', choices=('dev', 'wsgi', 'asgi'), default=['dev', 'wsgi', 'asgi'])
+    parser.add_argument('--editors', type=int, default=32, help='concurrent editors')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per server')
+    parser.add_argument('--slow-clients', type=int, default=8, help='concurrent slow uploads')
+    parser.add_argument('--url', help='test this running server instead of starting any')
+    args = parser.parse_args()
+    print(json.dumps(run(args.servers, args.editors, args.duration, args.slow_clients, args.url), indent=2))
+
+if __name__ == '__main__':
+    main()
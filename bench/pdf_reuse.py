@@ -0,0 +1,87 @@
+"""Compare PDF size and build time with inline label images vs a reused XObject.
+
+Run from the repository root:
+
+    python -m bench.pdf_reuse [--repeat N]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from labels.label_design import LabelDesign
+from pdf_generator import PDFGenerator
+
+LABEL_DATA = {
+    'beer_name': 'Hoppy Sunset',
+    'subtitle': 'India Pale Ale',
+    'abv': '6.5',
+    'beer_size': '500ML',
+    'border_color': '#000000',
+    'text_color': '#000000',
+    'font': 'Arial',
+    'font_size': 32
+}
+
+def make_background(path, size=(3000, 2000)):
+    """Write a noisy camera-sized background so image data does not compress away"""
+    img = Image.effect_noise(size, 64).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for i in range(0, size[0], 100):
+        draw.line([(i, 0), (size[0] - i, size[1])], fill=(i % 255, 80, 160), width=8)
+    img.save(path)
+
+def time_call(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def run(repeat=5):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, 'background.png')
+        make_background(image_path)
+        design = LabelDesign(image_path, LABEL_DATA)
+
+        render_time, label = time_call(lambda: design.render((540, 600)), repeat)
+        results['render_seconds'] = render_time
+
+        for mode, reuse in (('inline', False), ('xobject', True)):
+            generator = PDFGenerator(reuse_images=reuse)
+            for bottle_size in generator.label_sizes:
+                pdf_path = os.path.join(tmp, f'{mode}_{bottle_size}.pdf')
+                build_time, _ = time_call(
+                    lambda: generator.generate_pdf(pdf_path, label, label, bottle_size=bottle_size),
+                    repeat
+                )
+                results[f'{mode}_{bottle_size}'] = {
+                    'build_seconds': build_time,
+                    'bytes': os.path.getsize(pdf_path)
+                }
+
+        # Before: two renders per PDF plus inline images, after: one render plus the XObject
+        for bottle_size in PDFGenerator().label_sizes:
+            inline = results[f'inline_{bottle_size}']
+            xobject = results[f'xobject_{bottle_size}']
+            results[f'comparison_{bottle_size}'] = {
+                'size_ratio': inline['bytes'] / xobject['bytes'],
+                'before_seconds': 2 * render_time + inline['build_seconds'],
+                'after_seconds': render_time + xobject['build_seconds']
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+if __name__ == '__main__':
+    main()
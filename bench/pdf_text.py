@@ -0,0 +1,66 @@
+"""Compare print PDFs with vector text against PDFs embedding the whole label as one bitmap.
+
+Run from the repository root:
+
+    python -m bench.pdf_text [--repeat N]
+
+Text only stays sharp at any zoom in the vector PDFs. The fonts each PDF
+uses are listed, so a missing font file (Helvetica fallback) shows up.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from bench.pdf_reuse import LABEL_DATA, make_background, time_call
+from labels.image_cache import image_cache
+from labels.label_design import LabelDesign
+from labels.render import PDF_DPI
+from pdf_generator import PDFGenerator
+
+def embedded_fonts(pdf_path):
+    """Names of the fonts a PDF uses, read from its /BaseFont entries"""
+    with open(pdf_path, 'rb') as f:
+        data = f.read()
+    names = set()
+    for part in data.split(b'/BaseFont /')[1:]:
+        names.add(part.split(b'\n')[0].split(b' ')[0].split(b'/')[0].decode('latin-1'))
+    return sorted(names)
+
+def run(repeat=3):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, 'background.png')
+        make_background(image_path)
+        image_cache.working_image(image_path)
+
+        for bottle_size in PDFGenerator().label_sizes:
+            for mode, vector_text in (('raster', False), ('vector', True)):
+                design = LabelDesign(image_path, dict(LABEL_DATA, beer_size=bottle_size))
+                pdf_path = os.path.join(tmp, f'{mode}_{bottle_size}.pdf')
+                seconds, _ = time_call(
+                    lambda: design.generate_pdf(pdf_path, bottle_size, PDF_DPI, vector_text),
+                    repeat
+                )
+                results[f'{mode}_{bottle_size}'] = {
+                    'seconds': seconds,
+                    'bytes': os.path.getsize(pdf_path),
+                    'fonts': embedded_fonts(pdf_path)
+                }
+
+            raster = results[f'raster_{bottle_size}']
+            vector = results[f'vector_{bottle_size}']
+            results[f'comparison_{bottle_size}'] = {
+                'size_ratio': raster['bytes'] / vector['bytes'],
+                'speedup': raster['seconds'] / vector['seconds']
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Report label render time for each output mode: draft preview, full preview and 300 DPI print.
+
+Run from the repository root:
+
+    python -m bench.render_modes [--repeat N]
+
+Recrop timings resample the background from the decoded working copy, as
+after moving the crop; warm timings reuse the cropped background like
+repeated previews of one label do.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from bench.pdf_reuse import LABEL_DATA, make_background
+from labels.image_cache import image_cache
+from labels.render import LABEL_SIZE, PDF_DPI, encode_image, label_size, render_label
+from pdf_generator import PDFGenerator
+
+def modes():
+    generator = PDFGenerator()
+    result = {
+        'draft_preview': (label_size(0.5), 'BILINEAR'),
+        'preview': (LABEL_SIZE, 'LANCZOS')
+    }
+    for bottle_size in generator.label_sizes:
+        result[f'print_{bottle_size}'] = (generator.pixel_size(bottle_size, PDF_DPI), 'LANCZOS')
+    return result
+
+def time_render(image_path, size, resample, repeat, recrop):
+    timings = []
+    label = None
+    for i in range(repeat):
+        label_data = LABEL_DATA
+        if recrop:
+            # A crop not seen before misses the cropped background cache
+            label_data = dict(LABEL_DATA, crop_x=50 + (i + 1) / 1000)
+        start = time.perf_counter()
+        label = render_label(image_path, label_data, size, resample)
+        timings.append(time.perf_counter() - start)
+    return min(timings), label
+
+def run(repeat=20):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, 'background.png')
+        make_background(image_path)
+        image_cache.working_image(image_path)
+
+        for mode, (size, resample) in modes().items():
+            recrop, _ = time_render(image_path, size, resample, repeat, recrop=True)
+            warm, label = time_render(image_path, size, resample, repeat, recrop=False)
+            results[mode] = {
+                'size': list(size),
+                'resample': resample,
+                'recrop_seconds': recrop,
+                'warm_seconds': warm,
+                'webp_bytes': len(encode_image(label, 'WEBP', 80))
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,90 +1,357 @@
 import sqlite3
+from contextlib import contextmanager
 from datetime import datetime
+import hashlib
+import logging
 import os
+import queue
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+LABEL_COLUMNS = (
+    'uuid', 'beer_name', 'subtitle', 'abv', 'beer_size',
+    'border_color', 'text_color', 'font', 'font_size',
+    'image_scale', 'image_x', 'image_y',
+    'crop_x', 'crop_y', 'description', 'design_type', 'image_hash'
+)
+
+# Statements are kept as constants so every pooled connection reuses its
+# compiled copy from the sqlite3 statement cache
+UPSERT_LABEL_SQL = '''
+INSERT INTO BeerLabel ({columns}) VALUES ({placeholders})
+ON CONFLICT(uuid) DO UPDATE SET
+    {updates}
+'''.format(
+    columns=', '.join(LABEL_COLUMNS),
+    placeholders=', '.join('?' for _ in LABEL_COLUMNS),
+    updates=',\n    '.join(
+        # A save without a new image keeps the current one
+        f'{c} = COALESCE(excluded.{c}, BeerLabel.{c})' if c == 'image_hash' else f'{c} = excluded.{c}'
+        for c in LABEL_COLUMNS if c != 'uuid'
+    )
+)
+
+INSERT_IMAGE_SQL = 'INSERT OR IGNORE INTO LabelImage (hash, data, size) VALUES (?, ?, ?)'
+
+# Drop images no label refers to anymore
+PRUNE_IMAGE_SQL = '''
+DELETE FROM LabelImage
+WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM BeerLabel WHERE image_hash = ?)
+'''
+
+SELECT_LABEL_SQL = 'SELECT * FROM BeerLabel WHERE uuid = ?'
+
+SELECT_METADATA_SQL = '''
+SELECT
+    uuid, beer_name, subtitle, abv, beer_size,
+    border_color, text_color, font, font_size,
+    image_scale, image_x, image_y,
+    crop_x, crop_y, description, design_type, created_at, image_hash
+FROM BeerLabel
+'''
+
+SELECT_IMAGE_SQL = '''
+SELECT LabelImage.rowid, LabelImage.size
+FROM BeerLabel JOIN LabelImage ON LabelImage.hash = BeerLabel.image_hash
+WHERE BeerLabel.uuid = ?
+'''
+
+SELECT_LIST_SQL = '''
+SELECT
+    uuid, beer_name, subtitle, abv, beer_size,
+    description, design_type, created_at, thumbnail_hash
+FROM BeerLabel
+'''
+
+INSERT_THUMBNAIL_SQL = 'INSERT OR IGNORE INTO LabelThumbnail (hash, data, mimetype) VALUES (?, ?, ?)'
+
+PRUNE_THUMBNAIL_SQL = '''
+DELETE FROM LabelThumbnail
+WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM BeerLabel WHERE thumbnail_hash = ?)
+'''
+
+# SQLite's default limit on host parameters in older versions
+MAX_VARIABLES = 999
 
 class DBManager:
-    def __init__(self, db_path='database/beer_labels.db'):
+    def __init__(self, db_path='database/beer_labels.db', pool_size=8,
+                 busy_timeout=5000, synchronous='NORMAL'):
         self.db_path = db_path
-    
+        self.busy_timeout = busy_timeout  # milliseconds
+        self.synchronous = synchronous
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._has_search_index = None
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        # WAL lets readers run alongside a writer, NORMAL is durable enough with WAL
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        return conn
+
+    @contextmanager
     def _get_connection(self):
-        return sqlite3.connect(self.db_path)
-    
-    def save_beer_label(self, uuid, beer_name, subtitle, abv, beer_size, 
-                       border_color, text_color, font, font_size, image_scale,
-                       image_x, image_y, crop_x, crop_y, description, 
-                       design_type, image_data):
-        """Save or update a beer label in the database"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
+        """Borrow a pooled connection for the duration of the block"""
         try:
-            # Check if record exists
-            cursor.execute('SELECT 1 FROM BeerLabel WHERE uuid = ?', (uuid,))
-            exists = cursor.fetchone() is not None
-            
-            if exists:
-                # Update existing record
-                cursor.execute('''
-                UPDATE BeerLabel SET
-                    beer_name = ?, subtitle = ?, abv = ?, beer_size = ?,
-                    border_color = ?, text_color = ?, font = ?, font_size = ?,
-                    image_scale = ?, image_x = ?, image_y = ?,
-                    crop_x = ?, crop_y = ?, description = ?, design_type = ?,
-                    label_image = ?
-                WHERE uuid = ?
-                ''', (beer_name, subtitle, abv, beer_size, border_color,
-                      text_color, font, font_size, image_scale,
-                      image_x, image_y, crop_x, crop_y, description, design_type,
-                      image_data, uuid))
-            else:
-                # Insert new record
-                cursor.execute('''
-                INSERT INTO BeerLabel (
-                    uuid, beer_name, subtitle, abv, beer_size,
-                    border_color, text_color, font, font_size,
-                    image_scale, image_x, image_y,
-                    crop_x, crop_y, description, design_type, label_image
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (uuid, beer_name, subtitle, abv, beer_size, border_color,
-                      text_color, font, font_size, image_scale,
-                      image_x, image_y, crop_x, crop_y, description, design_type,
-                      image_data))
-            
-            conn.commit()
-            return True
-            
-        except Exception as e:
-            print(f"Database error: {e}")
-            conn.rollback()
-            return False
-            
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        try:
+            yield conn
         finally:
-            conn.close()
-    
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        """Close every pooled connection"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def save_beer_label(self, uuid, beer_name, subtitle, abv, beer_size,
+                       border_color, text_color, font, font_size, image_scale,
+                       image_x, image_y, crop_x, crop_y, description,
+                       design_type, image_data):
+        """Save or update a beer label in the database.
+
+        image_data of None keeps the label's current image.
+        """
+        return self.save_many([{
+            'uuid': uuid, 'beer_name': beer_name, 'subtitle': subtitle,
+            'abv': abv, 'beer_size': beer_size, 'border_color': border_color,
+            'text_color': text_color, 'font': font, 'font_size': font_size,
+            'image_scale': image_scale, 'image_x': image_x, 'image_y': image_y,
+            'crop_x': crop_x, 'crop_y': crop_y, 'description': description,
+            'design_type': design_type, 'image_data': image_data
+        }])
+
+    @metrics.timed('db_query_seconds')
+    def save_many(self, labels):
+        """Save or update several beer labels in one transaction.
+
+        Each label is a dict keyed by column name, with the image bytes (or
+        None to keep the current image) in 'image_data'.
+        """
+        rows = []
+        images = {}
+        for label in labels:
+            label = dict(label)
+            image_data = label.pop('image_data', None)
+            if image_data is not None:
+                if isinstance(image_data, str):
+                    image_data = image_data.encode('utf-8')
+                label['image_hash'] = hashlib.sha256(image_data).hexdigest()
+                images[label['image_hash']] = image_data
+            rows.append(tuple(label.get(column) for column in LABEL_COLUMNS))
+
+        with self._get_connection() as conn:
+            try:
+                previous = {
+                    row[17] for row in self._select_many(conn, [row[0] for row in rows])
+                    if row[17]
+                }
+
+                # Content already stored under its hash is not written again
+                conn.executemany(
+                    INSERT_IMAGE_SQL,
+                    [(image_hash, data, len(data)) for image_hash, data in images.items()]
+                )
+                # A single atomic UPSERT per row, no SELECT-then-write race
+                conn.executemany(UPSERT_LABEL_SQL, rows)
+                conn.executemany(
+                    PRUNE_IMAGE_SQL,
+                    [(image_hash, image_hash) for image_hash in previous - set(images)]
+                )
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.exception("Database error: %s", e)
+                conn.rollback()
+                return False
+
+    @metrics.timed('db_query_seconds')
     def get_beer_label(self, uuid):
         """Retrieve a beer label by UUID"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('SELECT * FROM BeerLabel WHERE uuid = ?', (uuid,))
-            return cursor.fetchone()
-        finally:
-            conn.close()
-    
+        with self._get_connection() as conn:
+            return conn.execute(SELECT_LABEL_SQL, (uuid,)).fetchone()
+
+    @metrics.timed('db_query_seconds')
+    def get_beer_label_metadata(self, uuid):
+        """Retrieve a beer label by UUID without its image.
+
+        The last column is the image_hash, None when the label has no image.
+        """
+        with self._get_connection() as conn:
+            return conn.execute(SELECT_METADATA_SQL + 'WHERE uuid = ?', (uuid,)).fetchone()
+
+    def _select_many(self, conn, uuids):
+        """Metadata rows for the given UUIDs, in chunks SQLite accepts"""
+        for start in range(0, len(uuids), MAX_VARIABLES):
+            chunk = uuids[start:start + MAX_VARIABLES]
+            placeholders = ', '.join('?' for _ in chunk)
+            yield from conn.execute(
+                SELECT_METADATA_SQL + f'WHERE uuid IN ({placeholders})', chunk
+            )
+
+    @metrics.timed('db_query_seconds')
+    def get_many(self, uuids):
+        """Retrieve the metadata rows of several beer labels, in the order requested.
+
+        Unknown UUIDs are skipped.
+        """
+        uuids = list(uuids)
+        with self._get_connection() as conn:
+            rows = {row[0]: row for row in self._select_many(conn, uuids)}
+        return [rows[uuid] for uuid in uuids if uuid in rows]
+
+    def iter_beer_label_image(self, uuid, chunk_size=256 * 1024):
+        """Stream the image of a beer label in chunks, without loading the whole blob"""
+        with self._get_connection() as conn:
+            row = conn.execute(SELECT_IMAGE_SQL, (uuid,)).fetchone()
+            if row is None:
+                return
+            rowid, size = row
+
+            if hasattr(conn, 'blobopen'):
+                # Incremental blob I/O, Python 3.11+
+                with conn.blobopen('LabelImage', 'data', rowid, readonly=True) as blob:
+                    while True:
+                        chunk = blob.read(chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+            else:
+                for offset in range(1, size + 1, chunk_size):
+                    yield conn.execute(
+                        'SELECT substr(data, ?, ?) FROM LabelImage WHERE rowid = ?',
+                        (offset, chunk_size, rowid)
+                    ).fetchone()[0]
+
+    @metrics.timed('db_query_seconds')
+    def get_beer_label_image(self, uuid):
+        """Retrieve only the image of a beer label"""
+        data = b''.join(self.iter_beer_label_image(uuid))
+        return data or None
+
+    @metrics.timed('db_query_seconds')
+    def save_thumbnail(self, uuid, data, mimetype):
+        """Attach a thumbnail to a label, dropping its previous one if nothing else uses it.
+
+        Returns the thumbnail's content hash, which is also its URL.
+        """
+        thumbnail_hash = hashlib.sha256(data).hexdigest()
+        with self._get_connection() as conn:
+            try:
+                row = conn.execute('SELECT thumbnail_hash FROM BeerLabel WHERE uuid = ?', (uuid,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute(INSERT_THUMBNAIL_SQL, (thumbnail_hash, data, mimetype))
+                conn.execute('UPDATE BeerLabel SET thumbnail_hash = ? WHERE uuid = ?', (thumbnail_hash, uuid))
+                if row[0] and row[0] != thumbnail_hash:
+                    conn.execute(PRUNE_THUMBNAIL_SQL, (row[0], row[0]))
+                conn.commit()
+                return thumbnail_hash
+            except Exception as e:
+                logger.exception("Database error: %s", e)
+                conn.rollback()
+                return None
+
+    @metrics.timed('db_query_seconds')
+    def get_thumbnail(self, thumbnail_hash):
+        """Return (data, mimetype) of a thumbnail, or None"""
+        with self._get_connection() as conn:
+            return conn.execute(
+                'SELECT data, mimetype FROM LabelThumbnail WHERE hash = ?', (thumbnail_hash,)
+            ).fetchone()
+
+    @metrics.timed('db_query_seconds')
+    def get_labels_for_thumbnails(self, missing_only=True):
+        """Metadata rows of the labels whose thumbnail should be (re)generated"""
+        sql = SELECT_METADATA_SQL
+        if missing_only:
+            sql += 'WHERE thumbnail_hash IS NULL\n'
+        with self._get_connection() as conn:
+            return conn.execute(sql + 'ORDER BY created_at DESC, uuid DESC').fetchall()
+
+    def _search_filter(self, conn, query):
+        """SQL condition and parameters restricting labels to a search query"""
+        if self._has_search_index is None:
+            self._has_search_index = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'BeerLabelSearch'"
+            ).fetchone() is not None
+
+        terms = query.split()
+        if self._has_search_index:
+            # Quote every term so user input can't use FTS syntax, match on prefixes
+            match = ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+            return ('uuid IN (SELECT uuid FROM BeerLabelSearch WHERE BeerLabelSearch MATCH ?)',
+                    [match])
+
+        conditions = []
+        params = []
+        for term in terms:
+            conditions.append('(beer_name LIKE ? OR subtitle LIKE ? OR description LIKE ?)')
+            params.extend([f'%{term}%'] * 3)
+        return ' AND '.join(conditions), params
+
+    @metrics.timed('db_query_seconds')
+    def list_beer_labels(self, limit=50, after=None, query=None):
+        """One page of beer labels (without images), newest first.
+
+        after is the (created_at, uuid) of the last label of the previous page.
+        Returns the rows and the cursor for the next page, None on the last page.
+        """
+        conditions = []
+        params = []
+        with self._get_connection() as conn:
+            if query and query.strip():
+                condition, condition_params = self._search_filter(conn, query)
+                conditions.append(condition)
+                params.extend(condition_params)
+            if after:
+                conditions.append('(created_at, uuid) < (?, ?)')
+                params.extend(after)
+
+            sql = SELECT_LIST_SQL
+            if conditions:
+                sql += 'WHERE ' + ' AND '.join(conditions) + '\n'
+            sql += 'ORDER BY created_at DESC, uuid DESC LIMIT ?'
+            # Fetch one extra row to know whether another page follows
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1][7], rows[-1][0])
+        return rows, next_cursor
+
+    @metrics.timed('db_query_seconds')
+    def count_beer_labels(self, query=None):
+        """Number of beer labels, optionally matching a search query"""
+        with self._get_connection() as conn:
+            sql = 'SELECT COUNT(*) FROM BeerLabel'
+            params = []
+            if query and query.strip():
+                condition, params = self._search_filter(conn, query)
+                sql += ' WHERE ' + condition
+            return conn.execute(sql, params).fetchone()[0]
+
+    @metrics.timed('db_query_seconds')
     def get_all_beer_labels(self):
         """Retrieve all beer labels (without image blobs)"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-            SELECT 
-                uuid, beer_name, subtitle, abv, beer_size, 
-                description, design_type, created_at 
-            FROM BeerLabel
-            ORDER BY created_at DESC
-            ''')
-            return cursor.fetchall()
-        finally:
-            conn.close() 
\ No newline at end of file
+        with self._get_connection() as conn:
+            return conn.execute(SELECT_LIST_SQL + 'ORDER BY created_at DESC, uuid DESC').fetchall()
@@ -1,16 +1,126 @@
 import sqlite3
+import hashlib
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 DATABASE_PATH = 'database/beer_labels.db'
 
+def migrate_label_images(conn):
+    """Move inline label_image blobs into the deduplicated LabelImage table.
+
+    Databases created before LabelImage existed keep the image in
+    BeerLabel.label_image. Each blob is stored once under its SHA-256 hash,
+    the row references it through image_hash and the old column is dropped.
+    """
+    cursor = conn.cursor()
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(BeerLabel)')]
+
+    if 'image_hash' not in columns:
+        cursor.execute('ALTER TABLE BeerLabel ADD COLUMN image_hash TEXT REFERENCES LabelImage(hash)')
+
+    if 'label_image' not in columns:
+        return
+
+    rows = cursor.execute(
+        'SELECT uuid, label_image FROM BeerLabel WHERE label_image IS NOT NULL'
+    ).fetchall()
+    for uuid, image_data in rows:
+        if isinstance(image_data, str):
+            image_data = image_data.encode('utf-8')
+        image_hash = hashlib.sha256(image_data).hexdigest()
+        cursor.execute(
+            'INSERT OR IGNORE INTO LabelImage (hash, data, size) VALUES (?, ?, ?)',
+            (image_hash, image_data, len(image_data))
+        )
+        cursor.execute('UPDATE BeerLabel SET image_hash = ? WHERE uuid = ?', (image_hash, uuid))
+
+    try:
+        cursor.execute('ALTER TABLE BeerLabel DROP COLUMN label_image')
+    except sqlite3.OperationalError:
+        # SQLite before 3.35 cannot drop columns, empty it instead
+        cursor.execute('UPDATE BeerLabel SET label_image = NULL')
+
+    logger.info("Migrated %d label images to LabelImage, run VACUUM to reclaim space", len(rows))
+
+def ensure_search_index(conn):
+    """Create the FTS5 index over beer_name/subtitle/description, kept in sync by triggers.
+
+    Returns False when this SQLite build has no FTS5, search then falls back to LIKE.
+    """
+    cursor = conn.cursor()
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'BeerLabelSearch'"
+    ).fetchone()
+    if exists:
+        return True
+
+    # The index keeps its own copy of the text keyed by uuid, BeerLabel has no
+    # INTEGER PRIMARY KEY so its rowids may change on VACUUM
+    try:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE BeerLabelSearch USING fts5(
+            uuid UNINDEXED, beer_name, subtitle, description
+        )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning("Full-text search unavailable: %s", e)
+        return False
+
+    cursor.executescript('''
+    CREATE TRIGGER IF NOT EXISTS BeerLabel_search_insert AFTER INSERT ON BeerLabel BEGIN
+        INSERT INTO BeerLabelSearch (uuid, beer_name, subtitle, description)
+        VALUES (new.uuid, new.beer_name, new.subtitle, new.description);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS BeerLabel_search_delete AFTER DELETE ON BeerLabel BEGIN
+        DELETE FROM BeerLabelSearch WHERE uuid = old.uuid;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS BeerLabel_search_update
+    AFTER UPDATE OF beer_name, subtitle, description ON BeerLabel BEGIN
+        DELETE FROM BeerLabelSearch WHERE uuid = old.uuid;
+        INSERT INTO BeerLabelSearch (uuid, beer_name, subtitle, description)
+        VALUES (new.uuid, new.beer_name, new.subtitle, new.description);
+    END;
+    ''')
+
+    # Index the labels that existed before the search table
+    cursor.execute('''
+    INSERT INTO BeerLabelSearch (uuid, beer_name, subtitle, description)
+    SELECT uuid, beer_name, subtitle, description FROM BeerLabel
+    ''')
+    return True
+
 def ensure_database_exists():
     """Create the database and tables if they don't exist"""
     # Ensure the database directory exists
     os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-    
+
     conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
-    
+
+    # Background images, stored once per distinct content
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS LabelImage (
+        hash TEXT PRIMARY KEY,
+        data BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # Small renders shown on the list page, stored once per distinct content
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS LabelThumbnail (
+        hash TEXT PRIMARY KEY,
+        data BLOB NOT NULL,
+        mimetype TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
     # Create the BeerLabel table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS BeerLabel (
@@ -31,10 +141,26 @@ def ensure_database_exists():
         description TEXT,
         design_type TEXT NOT NULL,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        label_image BLOB
+        image_hash TEXT REFERENCES LabelImage(hash),
+        thumbnail_hash TEXT REFERENCES LabelThumbnail(hash)
     )
     ''')
-    
+
+    migrate_label_images(conn)
+
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(BeerLabel)')]
+    if 'thumbnail_hash' not in columns:
+        # Existing labels get their thumbnails from `flask backfill-thumbnails`
+        cursor.execute('ALTER TABLE BeerLabel ADD COLUMN thumbnail_hash TEXT REFERENCES LabelThumbnail(hash)')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_beerlabel_image_hash ON BeerLabel (image_hash)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_beerlabel_thumbnail_hash ON BeerLabel (thumbnail_hash)')
+
+    # Keyset pagination of the label list walks this index
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_beerlabel_created ON BeerLabel (created_at DESC, uuid DESC)')
+
+    ensure_search_index(conn)
+
     conn.commit()
     conn.close()
 
@@ -42,6 +168,6 @@ def init_db():
     """Initialize the database"""
     try:
         ensure_database_exists()
-        print("Database initialized successfully")
+        logger.info("Database initialized successfully")
     except Exception as e:
-        print(f"Error initializing database: {e}") 
\ No newline at end of file
+        logger.exception("Error initializing database: %s", e)
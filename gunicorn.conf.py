@@ -0,0 +1,50 @@
+"""Production launcher settings, gunicorn reads them from the working directory:
+
+    pip install -r requirements.txt
+    gunicorn                              # threaded WSGI workers serving app:app
+    LABELIZER_SERVER=asgi gunicorn        # uvicorn workers serving asgi:application
+
+Every server worker is a separate process with its own render workers,
+caches and upload janitor. Settings come from LABELIZER_* environment
+variables, anything else can be overridden on the command line.
+"""
+import os
+
+SERVER = os.environ.get('LABELIZER_SERVER', 'wsgi')  # 'wsgi' or 'asgi'
+
+bind = os.environ.get('LABELIZER_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('LABELIZER_WEB_WORKERS', 2))
+
+if SERVER == 'asgi':
+    wsgi_app = 'asgi:application'
+    # gunicorn's own asgi worker stalls keep-alive connections behind a2wsgi
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'app:app'
+    worker_class = 'gthread'
+    # Requests handled at once per worker, idle keep-alive connections don't take a thread.
+    # More than RENDER_QUEUE_SIZE plus the render workers only adds 503s under load.
+    threads = int(os.environ.get('LABELIZER_WEB_THREADS', 16))
+
+# Seconds an idle connection stays open for the editor's next preview
+keepalive = int(os.environ.get('LABELIZER_KEEPALIVE', 5))
+# Longer than RENDER_TIMEOUT, a worker this silent is stuck
+timeout = 60
+graceful_timeout = 30
+
+# The server workers share the cores for their render workers
+os.environ.setdefault('LABELIZER_RENDER_WORKERS', str(max(1, (os.cpu_count() or 2) // workers)))
+
+# Each worker imports the app itself: the janitor thread and render pool must not be forked
+preload_app = False
+
+def post_worker_init(worker):
+    if SERVER == 'wsgi':
+        # The ASGI app does this on its lifespan startup
+        from app import render_executor
+        render_executor.warm_up()
+
+def worker_exit(server, worker):
+    if SERVER == 'wsgi':
+        from app import render_executor
+        render_executor.shutdown()
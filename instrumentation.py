@@ -0,0 +1,166 @@
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+# Upper bounds in seconds, from a cached lookup to a slow batch PDF
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PREFIX = 'labelizer_'
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """Histograms, counters and gauges, rendered in the Prometheus text format.
+
+    Series are keyed by a name and labels. Code that may run in a render
+    worker records through observe() and count(); while collect() is active
+    on the thread the records are kept for the job instead, and the process
+    that submitted the job merges them, so both executor backends count
+    every stage exactly once.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def _record(self, kind, name, value, labels):
+        records = getattr(self._local, 'records', None)
+        if records is not None:
+            records.append((kind, name, value, labels))
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            if kind == 'histogram':
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(self.buckets)
+                histogram.observe(value)
+            else:
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add a value (usually seconds) to the histogram name{labels}"""
+        self._record('histogram', name, value, labels)
+
+    def count(self, name, amount=1, **labels):
+        """Increment the counter name{labels}"""
+        self._record('counter', name, amount, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stage(self, stage):
+        """Time one render stage: decode, crop_resize, font_load, text_draw, composite, encode, pdf_build"""
+        return self.timer('stage_seconds', stage=stage)
+
+    def timed(self, name):
+        """Decorator timing every call into name{operation=<function name>}"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, operation=fn.__name__):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def cache(self, cache, hit):
+        """Count a cache lookup, hit ratios are hits / (hits + misses)"""
+        self.count('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+    def gauge(self, name, fn):
+        """Report fn() as the gauge name whenever metrics are rendered"""
+        self._gauges[name] = fn
+
+    @contextmanager
+    def collect(self):
+        """Keep this thread's records in a list instead of the registry"""
+        previous = getattr(self._local, 'records', None)
+        records = self._local.records = []
+        try:
+            yield records
+        finally:
+            self._local.records = previous
+
+    def merge(self, records):
+        """Add records from collect(), e.g. sent back by a render worker"""
+        for kind, name, value, labels in records:
+            self._record(kind, name, value, labels)
+
+    @staticmethod
+    def _labels(labels, **extra):
+        pairs = list(labels) + list(extra.items())
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        """Every series in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        declared = set()
+        for (name, labels), histogram in histograms:
+            name = PREFIX + name
+            if name not in declared:
+                declared.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{self._labels(labels, le="+Inf")} {histogram.count}')
+            lines.append(f'{name}_sum{self._labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{self._labels(labels)} {histogram.count}')
+
+        for (name, labels), value in counters:
+            name = PREFIX + name
+            if name not in declared:
+                declared.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{self._labels(labels)} {value}')
+
+        for name, fn in sorted(self._gauges.items()):
+            name = PREFIX + name
+            try:
+                value = fn()
+            except Exception as e:
+                lines.append(f'# {name} unavailable: {e}')
+                continue
+            if value is None:
+                continue
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+# Shared by the app, the label designs and the render workers of this process
+metrics = Metrics()
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from PIL import Image
 
 class BaseLabel:
     @abstractmethod
@@ -6,11 +7,23 @@ class BaseLabel:
         pass
 
     @abstractmethod
-    def generate_preview(self):
-        """Generate a preview image of the label"""
+    def render(self, size, resample, session=None):
+        """Render the label artwork as a PIL image of the given size.
+
+        Geometry scales with size, resample is used for the background image.
+        Renders with the same session (e.g. the label's uuid) may reuse layers
+        of the previous one.
+        """
         pass
 
+    def render_print(self, size, vector_text=True, background_quality=90):
+        """Artwork for print PDFs, a PIL image or a pdf_generator.VectorLabel.
+
+        Designs without a vector path print their bitmap.
+        """
+        return self.render(size, Image.Resampling.LANCZOS)
+
     @abstractmethod
-    def generate_pdf(self, uuid, beer_name, bottle_size='500ML'):
-        """Generate a PDF with the label layout"""
+    def generate_pdf(self, output, bottle_size='500ML'):
+        """Write a PDF with the label layout to output, a path or binary file object"""
         pass 
\ No newline at end of file
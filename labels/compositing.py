@@ -0,0 +1,153 @@
+from PIL import Image, ImageColor
+import logging
+import threading
+from .image_cache import image_cache
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed for the numpy engine
+    np = None
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ('pillow', 'numpy')
+
+class Compositor:
+    """Selects how label layers are combined into the final image.
+
+    'pillow' builds the label from a chain of Pillow images. 'numpy' writes
+    every layer straight into one canvas array and blends the text box in a
+    single pass, reusing per-thread buffers so a render allocates little
+    besides the output image itself. Both
+    engines produce identical pixels (see bench/compositing.py).
+    """
+
+    def __init__(self, engine='pillow'):
+        self.engine = engine
+        self._scratch = threading.local()
+
+    def configure(self, engine='pillow'):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown compositing engine: {engine}")
+        if engine == 'numpy' and np is None:
+            logger.warning("NumPy is not installed, using the pillow compositing engine")
+            engine = 'pillow'
+        self.engine = engine
+        return engine
+
+    def _buffer(self, key, factory):
+        """Array allocated once per thread and key, then reused by every render"""
+        buffers = getattr(self._scratch, 'buffers', None)
+        if buffers is None:
+            buffers = self._scratch.buffers = {}
+        if key not in buffers:
+            buffers[key] = factory()
+        return buffers[key]
+
+    @staticmethod
+    def _div255(value, out):
+        """Pillow's rounded division by 255, value is clobbered.
+
+        Every blend here stays below 255 * 255 + 255, so uint16 is wide enough.
+        """
+        value += 128
+        np.right_shift(value, 8, out=out)
+        out += value
+        out >>= 8
+        return out
+
+    @staticmethod
+    def background_array(background, cache_key):
+        """RGB pixels of a cropped background as an array, cached next to the image"""
+        key = cache_key + ('array',)
+        pixels = image_cache.get(key)
+        if pixels is None:
+            if background.mode == 'RGBA':
+                # Pillow pastes RGBA onto RGB without a mask by dropping alpha
+                pixels = np.ascontiguousarray(np.asarray(background)[..., :3])
+            else:
+                pixels = np.asarray(background if background.mode == 'RGB' else background.convert('RGB'))
+            image_cache.put(key, pixels)
+        return pixels
+
+    def composite(self, size, fill, pixels, background_pos, boxes, border_color, border_width):
+        """Build the label in one reused canvas and return it as a new image.
+
+        pixels is the background from background_array(), or None. boxes are
+        (box_pos, rotation, box_fill, text_mask, text_color, overlay_mask,
+        overlay_color): text_mask is the coverage of the lines drawn on the
+        unrotated box, overlay_mask the coverage of the overlay on the rotated
+        box, both mode 'L', and overlay_color is RGBA. The box is box_fill with
+        text_color text, the overlay blends its colour in and makes the box
+        as opaque as its alpha, matching the pillow engine.
+        """
+        width, height = size
+        canvas = self._buffer(('canvas', size), lambda: np.empty((height, width, 3), np.uint8))
+
+        covered = False
+        if pixels is not None:
+            x, y = background_pos
+            left, top = max(x, 0), max(y, 0)
+            right, bottom = min(x + pixels.shape[1], width), min(y + pixels.shape[0], height)
+            covered = (left, top, right, bottom) == (0, 0, width, height)
+        if not covered:
+            # Fill one row and copy it down, much faster than broadcasting a colour tuple
+            canvas[0] = ImageColor.getrgb(fill)[:3]
+            canvas[1:] = canvas[0]
+        if pixels is not None and left < right and top < bottom:
+            canvas[top:bottom, left:right] = pixels[top - y:bottom - y, left - x:right - x]
+
+        for box_pos, rotation, box_fill, text_mask, text_color, overlay_mask, overlay_color in boxes:
+            letter = np.asarray(overlay_mask)
+            planes = self._buffer(('planes', letter.shape), lambda: [np.empty(letter.shape, np.uint16) for _ in range(7)])
+            text, inverse, alpha, inverse_alpha, box, scratch, ink = planes
+
+            # Transposing the coverage is the rotation, counter-clockwise like Pillow
+            np.copyto(text, np.rot90(np.asarray(text_mask), rotation // 90))
+
+            # The overlay takes the box towards its alpha: 255 * (255 - l) + a * l
+            *overlay_rgb, overlay_alpha = overlay_color
+            np.subtract(255, letter, out=inverse)
+            np.multiply(inverse, 255, out=box)
+            np.multiply(letter, np.uint16(overlay_alpha), out=scratch)
+            box += scratch
+            self._div255(box, alpha)
+            np.subtract(255, alpha, out=inverse_alpha)
+
+            left, top = box_pos
+            box_height, box_width = letter.shape
+            region = canvas[top:top + box_height, left:left + box_width]
+            text_color = ImageColor.getrgb(text_color)
+            for channel in range(3):
+                # Filled box with the text blended in: fill * (255 - t) + ink * t
+                np.subtract(255, text, out=scratch)
+                scratch *= box_fill[channel]
+                np.multiply(text, np.uint16(text_color[channel]), out=box)
+                box += scratch
+                self._div255(box, scratch)
+
+                # The overlay pulls the box towards its colour
+                np.multiply(scratch, inverse, out=box)
+                if overlay_rgb[channel]:
+                    np.multiply(letter, np.uint16(overlay_rgb[channel]), out=ink)
+                    box += ink
+                self._div255(box, scratch)
+
+                # Alpha-blend the box onto the label
+                np.multiply(scratch, alpha, out=box)
+                np.multiply(region[..., channel], inverse_alpha, out=scratch)
+                box += scratch
+                region[..., channel] = self._div255(box, scratch)
+
+        if border_width:
+            color = ImageColor.getrgb(border_color)[:3]
+            canvas[:border_width] = color
+            canvas[-border_width:] = color
+            canvas[:, :border_width] = color
+            canvas[:, -border_width:] = color
+
+        # fromarray copies the canvas into the image, so the canvas can be reused
+        return Image.fromarray(canvas, 'RGB')
+
+# Shared by every label design in this process
+compositor = Compositor()
@@ -0,0 +1,372 @@
+from fractions import Fraction
+from PIL import Image, ImageColor, ImageDraw
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+from .fonts import font_registry
+
+logger = logging.getLogger(__name__)
+
+# Specs shipped with the app, one JSON file per design type
+DESIGN_DIR = os.path.join(os.path.dirname(__file__), 'designs')
+
+DEFAULT_DESIGN = 'design1'
+
+# Output size spec lengths in pixels refer to, unless a spec sets base_size
+DEFAULT_BASE_SIZE = (540, 600)
+
+ROTATIONS = (0, 90, 180, 270)
+ALIGNMENTS = ('left', 'center', 'right')
+WEIGHTS = ('regular', 'bold')
+
+# Plans kept per design, one per output size in use
+MAX_PLANS = 32
+
+# What templates get for fields label_data leaves out
+FIELD_DEFAULTS = {
+    'beer_size': '500ML',
+    'text_color': '#000000',
+    'border_color': '#000000',
+    'font': 'Arial',
+    'font_size': 32
+}
+
+# Text is measured without drawing, one scratch canvas serves every label
+_measure = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+class Fields(dict):
+    """label_data as seen by spec templates, missing fields are defaults or empty"""
+
+    def __missing__(self, key):
+        return FIELD_DEFAULTS.get(key, '')
+
+def _is_length(value):
+    if isinstance(value, str):
+        try:
+            return value.endswith('%') and Fraction(value[:-1]) >= 0
+        except ValueError:
+            return False
+    return isinstance(value, (int, float)) and value >= 0
+
+def _length(value, total, scale):
+    """Pixels of a spec length: base pixels scaled with the label, or 'N%' of total"""
+    if isinstance(value, str):
+        return total * Fraction(value[:-1]) // 100
+    return round(value * scale)
+
+def _anchor(anchor):
+    """(horizontal, vertical) alignment of an anchor like 'right', 'bottom' or 'top-left'"""
+    horizontal = vertical = 'center'
+    for part in anchor.split('-'):
+        if part in ('left', 'right'):
+            horizontal = part
+        elif part in ('top', 'bottom'):
+            vertical = part
+        elif part != 'center':
+            raise ValueError(f"unknown anchor {anchor!r}")
+    return horizontal, vertical
+
+def _place(align, space, length, start=0):
+    """Offset of something length long aligned within space, which begins at start"""
+    if align in ('left', 'top'):
+        return start
+    if align in ('right', 'bottom'):
+        return start + space - length
+    return start + (space - length) // 2
+
+def _check_text(run, where):
+    for key in ('text', 'font'):
+        if not isinstance(run.get(key), str):
+            raise ValueError(f"{where} needs a {key} template")
+    if run.get('weight', 'regular') not in WEIGHTS:
+        raise ValueError(f"{where} has an unknown weight")
+    size = run.get('size')
+    if isinstance(size, dict):
+        if not isinstance(size.get('field'), str) or not isinstance(size.get('add', 0), (int, float)):
+            raise ValueError(f"{where} size needs a field and an optional number to add")
+    elif not isinstance(size, (int, float)) or size <= 0:
+        raise ValueError(f"{where} needs a size")
+    if run.get('align', 'left') not in ALIGNMENTS:
+        raise ValueError(f"{where} has an unknown align")
+
+def validate_spec(spec):
+    """Raise ValueError when a parsed spec is not a usable design"""
+    if not isinstance(spec, dict) or not isinstance(spec.get('layers'), list) or not spec['layers']:
+        raise ValueError("a design needs a list of layers")
+    base_size = spec.get('base_size', DEFAULT_BASE_SIZE)
+    if len(base_size) != 2 or min(base_size) <= 0:
+        raise ValueError("base_size must be [width, height]")
+
+    seen = set()
+    for index, layer in enumerate(spec['layers']):
+        kind = layer.get('type') if isinstance(layer, dict) else None
+        where = f"layer {index} ({kind})"
+        if kind in ('background', 'border'):
+            if kind in seen:
+                raise ValueError(f"{where}: only one {kind} layer is allowed")
+            seen.add(kind)
+        if kind == 'background':
+            if layer.get('landscape', 'cover') not in ('cover', 'square'):
+                raise ValueError(f"{where}: landscape must be 'cover' or 'square'")
+        elif kind == 'border':
+            if not isinstance(layer.get('width', 1), (int, float)) or layer.get('width', 1) <= 0:
+                raise ValueError(f"{where}: width must be positive")
+        elif kind == 'text_box':
+            for key in ('width', 'height'):
+                if not _is_length(layer.get(key)):
+                    raise ValueError(f"{where}: {key} must be base pixels or a percentage")
+            if layer.get('inset', 0) != 'border' and not _is_length(layer.get('inset', 0)):
+                raise ValueError(f"{where}: inset must be base pixels or 'border'")
+            _anchor(layer.get('anchor', 'center'))
+            if layer.get('rotation', 0) not in ROTATIONS:
+                raise ValueError(f"{where}: rotation must be one of {ROTATIONS}")
+            if layer.get('align', 'left') not in ALIGNMENTS:
+                raise ValueError(f"{where}: unknown align")
+            if not isinstance(layer.get('lines', []), list):
+                raise ValueError(f"{where}: lines must be a list")
+            for number, line in enumerate(layer.get('lines', [])):
+                _check_text(dict(line, align=layer.get('align', 'left')), f"{where} line {number}")
+            overlay = layer.get('overlay')
+            if overlay is not None:
+                _check_text(overlay, f"{where} overlay")
+                if not 0 <= overlay.get('opacity', 1) <= 1:
+                    raise ValueError(f"{where}: overlay opacity must be between 0 and 1")
+        else:
+            raise ValueError(f"{where}: unknown layer type")
+
+@functools.lru_cache(maxsize=1024)
+def stack_lines(lines, content_width, padding, spacing, align):
+    """Runs of lines stacked from the top of a box, each (text, family, weight, size, (x, y)).
+
+    (x, y) is the top-left corner Pillow draws the text at. Cached, the same
+    texts in the same fonts are measured once.
+    """
+    runs = []
+    y = padding
+    for text, family, weight, size in lines:
+        bbox = _measure.textbbox((0, 0), text, font=font_registry.get(family, weight, size))
+        x = _place(align, content_width - 2 * padding, bbox[2] - bbox[0], padding)
+        runs.append((text, family, weight, size, (x, y)))
+        y += bbox[3] - bbox[1] + spacing
+    return tuple(runs)
+
+class DrawPlan:
+    """A design compiled for one output size: everything that does not depend on label_data.
+
+    layers holds (type, data) in drawing order, text boxes refer to their
+    entry in boxes. Box geometry is in output pixels: pos and size are the
+    box on the label, content_size is the box before rotation, which is
+    what its lines are laid out in.
+    """
+
+    def __init__(self, design, size):
+        width, height = size
+        self.size = size
+        self.scale = min(width / design.base_size[0], height / design.base_size[1])
+        self.background = None
+        self.border = None
+        self.boxes = []
+        self.layers = []
+
+        border = next((layer for layer in design.layers if layer['type'] == 'border'), None)
+        border_width = max(1, round(border.get('width', 1) * self.scale)) if border else 0
+
+        for layer in design.layers:
+            if layer['type'] == 'background':
+                # Landscape labels can keep a square image instead of stretching it across
+                square = layer.get('landscape', 'cover') == 'square' and height <= width
+                self.background = {
+                    'target_size': (min(size), min(size)) if square else size,
+                    'fill': layer.get('fill', 'white'),
+                    'empty_fill': layer.get('empty_fill', layer.get('fill', 'white'))
+                }
+                self.layers.append(('background', self.background))
+            elif layer['type'] == 'border':
+                self.border = {'width': border_width, 'color': layer.get('color', '{border_color}')}
+                self.layers.append(('border', self.border))
+            else:
+                self.boxes.append(self._compile_box(layer, border_width))
+                self.layers.append(('text_box', len(self.boxes) - 1))
+
+        # Background first and border last is what the numpy and vector paths draw
+        kinds = [kind for kind, _ in self.layers]
+        self.standard_order = kinds == sorted(kinds, key=['background', 'text_box', 'border'].index)
+
+    def _compile_box(self, layer, border_width):
+        width, height = self.size
+        inset = layer.get('inset', 0)
+        inset = border_width if inset == 'border' else _length(inset, min(self.size), self.scale)
+
+        # Percentages are of the label, the box always stays inside the inset
+        box_width = min(_length(layer['width'], width, self.scale), width - 2 * inset)
+        box_height = min(_length(layer['height'], height, self.scale), height - 2 * inset)
+        horizontal, vertical = _anchor(layer.get('anchor', 'center'))
+        pos = (
+            _place(horizontal, width - 2 * inset, box_width, inset),
+            _place(vertical, height - 2 * inset, box_height, inset)
+        )
+
+        rotation = layer.get('rotation', 0)
+        content_size = (box_height, box_width) if rotation in (90, 270) else (box_width, box_height)
+
+        overlay = layer.get('overlay')
+        if overlay is not None:
+            overlay = dict(
+                overlay,
+                y=_length(overlay.get('y', 0), height, self.scale),
+                alpha=round(overlay.get('opacity', 1) * 255),
+                color=overlay.get('color', '#000000')
+            )
+
+        return {
+            'pos': pos,
+            'size': (box_width, box_height),
+            'content_size': content_size,
+            'rotation': rotation,
+            'fill': layer.get('fill', 'white'),
+            'color': layer.get('color', '{text_color}'),
+            'padding': _length(layer.get('padding', 0), width, self.scale),
+            'spacing': _length(layer.get('spacing', 0), height, self.scale),
+            'align': layer.get('align', 'left'),
+            'lines': layer.get('lines', []),
+            'overlay': overlay
+        }
+
+    def fill(self, has_image):
+        """Colour of the label canvas under every layer"""
+        if self.background is None:
+            return 'white'
+        return self.background['fill'] if has_image else self.background['empty_fill']
+
+    def _font_size(self, size, fields):
+        if isinstance(size, dict):
+            size = int(fields[size['field']]) + size.get('add', 0)
+        return max(1, round(size * self.scale))
+
+    def layout(self, fields):
+        """Texts, positions and colours of one label, fields from label_data"""
+        boxes = []
+        for box in self.boxes:
+            lines = tuple(
+                (line['text'].format_map(fields), line['font'].format_map(fields),
+                 line.get('weight', 'regular'), self._font_size(line['size'], fields))
+                for line in box['lines']
+            )
+            runs = stack_lines(lines, box['content_size'][0], box['padding'], box['spacing'], box['align'])
+
+            # The overlay is drawn on the box after rotation, upright on the label
+            overlay = box['overlay']
+            overlay_run = overlay_color = None
+            if overlay is not None:
+                text = overlay['text'].format_map(fields)[:overlay.get('max_chars')]
+                if text:
+                    family = overlay['font'].format_map(fields)
+                    weight = overlay.get('weight', 'regular')
+                    size = self._font_size(overlay['size'], fields)
+                    bbox = _measure.textbbox((0, 0), text, font=font_registry.get(family, weight, size))
+                    x = _place(overlay.get('align', 'left'), box['size'][0], bbox[2] - bbox[0])
+                    overlay_run = (text, family, weight, size, (x, overlay['y']))
+                    overlay_color = ImageColor.getrgb(overlay['color'].format_map(fields))[:3] + (overlay['alpha'],)
+
+            boxes.append({
+                'plan': box,
+                'runs': runs,
+                'color': box['color'].format_map(fields),
+                'fill': box['fill'].format_map(fields),
+                'overlay': overlay_run,
+                'overlay_color': overlay_color
+            })
+
+        return {
+            'boxes': boxes,
+            'border_color': self.border['color'].format_map(fields) if self.border else None
+        }
+
+class Design:
+    """A label design loaded from a spec, with its draw plans compiled on first use"""
+
+    def __init__(self, name, spec, source=None):
+        validate_spec(spec)
+        self.name = name
+        self.source = source
+        self.title = spec.get('title', name)
+        self.base_size = tuple(spec.get('base_size', DEFAULT_BASE_SIZE))
+        self.layers = spec['layers']
+        # Part of render cache keys, so editing a spec never serves stale renders
+        digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+        self.key = f"{name}:{digest[:16]}"
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def plan(self, size):
+        """The draw plan at size, compiled once and shared by every render"""
+        size = tuple(size)
+        plan = self._plans.get(size)
+        if plan is None:
+            plan = DrawPlan(self, size)
+            with self._lock:
+                if len(self._plans) >= MAX_PLANS:
+                    self._plans.clear()
+                self._plans[size] = plan
+        return plan
+
+def load_design(path):
+    """Load and validate the spec at path, the file name is the design type"""
+    with open(path) as f:
+        spec = json.load(f)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return Design(name, spec, source=path)
+
+class DesignRegistry:
+    """Designs loaded from the JSON specs in a directory, keyed by file name.
+
+    A spec added to the directory is picked up the first time its design
+    type is requested, changes to a loaded spec need a restart.
+    """
+
+    def __init__(self, design_dir=DESIGN_DIR):
+        self.design_dir = design_dir
+        self._designs = None
+        self._lock = threading.Lock()
+
+    def configure(self, design_dir=DESIGN_DIR):
+        """Load the specs in design_dir, invalid ones are reported and skipped"""
+        with self._lock:
+            self.design_dir = design_dir
+            self._designs = None
+        return self.load()
+
+    def load(self):
+        """Pick up specs added since the last load"""
+        with self._lock:
+            designs = dict(self._designs or {})
+            for filename in sorted(os.listdir(self.design_dir)):
+                name, ext = os.path.splitext(filename)
+                if ext != '.json' or name in designs:
+                    continue
+                path = os.path.join(self.design_dir, filename)
+                try:
+                    designs[name] = load_design(path)
+                except (OSError, ValueError) as e:
+                    logger.warning("Skipping design spec %s: %s", path, e)
+            self._designs = designs
+            return designs
+
+    def get(self, name):
+        """The design for a design type, ValueError when there is none"""
+        designs = self._designs
+        if designs is None or name not in designs:
+            designs = self.load()
+        design = designs.get(name)
+        if design is None:
+            raise ValueError('Invalid design type')
+        return design
+
+    def designs(self):
+        return list((self._designs if self._designs is not None else self.load()).values())
+
+# Shared by every label render in this process
+design_registry = DesignRegistry()
@@ -0,0 +1,168 @@
+from PIL import ImageFont
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+import hashlib
+import logging
+import os
+import sys
+import threading
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+# Map font names offered in the editor to their regular font files
+FONT_FILES = {
+    'Arial': 'Arial.ttf',
+    'Helvetica': 'Helvetica.ttf',
+    'Times-Roman': 'Times New Roman.ttf',
+    'Courier': 'Courier New.ttf',
+    'Verdana': 'Verdana.ttf'
+}
+
+DEFAULT_FAMILY = 'Arial'
+
+def system_font_dirs():
+    """Directories Pillow would search when given a bare font filename"""
+    if sys.platform == 'win32':
+        return [os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'fonts')]
+    if sys.platform == 'darwin':
+        return [
+            '/Library/Fonts',
+            '/System/Library/Fonts',
+            os.path.expanduser('~/Library/Fonts')
+        ]
+    data_dirs = os.environ.get('XDG_DATA_DIRS') or '/usr/share'
+    dirs = [os.path.join(d, 'fonts') for d in data_dirs.split(':')]
+    dirs.append(os.path.expanduser('~/.local/share/fonts'))
+    return dirs
+
+class FontRegistry:
+    """Resolves font files once and shares loaded font objects across all label designs"""
+
+    def __init__(self, font_dir=None, font_files=FONT_FILES):
+        self.font_dir = font_dir
+        self.font_files = dict(font_files)
+        self._paths = None
+        self._fonts = {}
+        self._pdf_fonts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def font_filename(family_file, weight):
+        if weight == 'bold':
+            return family_file.replace('.ttf', ' Bold.ttf')
+        return family_file
+
+    def configure(self, font_dir=None):
+        """Set the font directory and resolve every known family up front"""
+        with self._lock:
+            self.font_dir = font_dir
+            self._fonts.clear()
+            self._pdf_fonts.clear()
+            self._paths = None
+        return self.resolve()
+
+    def resolve(self):
+        """Locate the font file of every family and weight, reporting missing ones once"""
+        with self._lock:
+            if self._paths is not None:
+                return self._paths
+
+            search_dirs = ([self.font_dir] if self.font_dir else []) + system_font_dirs()
+            available = {}
+            for search_dir in search_dirs:
+                for root, _, files in os.walk(search_dir):
+                    for name in files:
+                        available.setdefault(name.lower(), os.path.join(root, name))
+
+            paths = {}
+            for family, family_file in self.font_files.items():
+                for weight in ('regular', 'bold'):
+                    filename = self.font_filename(family_file, weight)
+                    if os.path.isfile(filename):
+                        path = filename
+                    else:
+                        path = available.get(filename.lower())
+                    if path is None:
+                        logger.warning("Font not found: %s (%s %s), using default font", filename, family, weight)
+                    paths[(family, weight)] = path
+
+            self._paths = paths
+            return paths
+
+    def resolved(self):
+        """Which family/weight combinations resolved to a font file"""
+        return {
+            f"{family} {weight}": path
+            for (family, weight), path in self.resolve().items()
+        }
+
+    def digest(self):
+        """Hash of the resolved font files, changes when a font is installed, replaced or removed"""
+        digest = hashlib.sha256()
+        for (family, weight), path in sorted(self.resolve().items()):
+            try:
+                stat = os.stat(path) if path else None
+            except OSError:
+                stat = None
+            signature = (stat.st_size, stat.st_mtime_ns) if stat else None
+            digest.update(repr((family, weight, path, signature)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, family, weight='regular', size=32):
+        """Return a cached font object for (family, weight, size)"""
+        if family not in self.font_files:
+            family = DEFAULT_FAMILY
+        key = (family, weight, size)
+        font = self._fonts.get(key)
+        metrics.cache('font', font is not None)
+        if font is not None:
+            return font
+
+        path = self.resolve().get((family, weight))
+        with metrics.stage('font_load'):
+            if path:
+                try:
+                    font = ImageFont.truetype(path, size)
+                except Exception as e:
+                    logger.warning("Font error for %s: %s", path, e)
+            if font is None:
+                font = ImageFont.load_default()
+
+        with self._lock:
+            return self._fonts.setdefault(key, font)
+
+    def pdf_font(self, family, weight='regular'):
+        """ReportLab font name for (family, weight), embedding its TrueType file on first use.
+
+        Falls back to the built-in Helvetica when the font file is missing.
+        """
+        if family not in self.font_files:
+            family = DEFAULT_FAMILY
+        key = (family, weight)
+        font = self._pdf_fonts.get(key)
+        if font is not None:
+            return font[0]
+
+        font = ('Helvetica-Bold' if weight == 'bold' else 'Helvetica', False)
+        path = self.resolve().get(key)
+        if path:
+            try:
+                pdfmetrics.registerFont(TTFont(f"{family}-{weight}", path))
+                font = (f"{family}-{weight}", True)
+            except Exception as e:
+                logger.warning("PDF font error for %s: %s", path, e)
+
+        with self._lock:
+            return self._pdf_fonts.setdefault(key, font)[0]
+
+    def pdf_ascent(self, family, weight, size):
+        """Distance from where Pillow draws text (its ascender line) to the baseline in a PDF"""
+        name = self.pdf_font(family, weight)
+        if self._pdf_fonts[(family if family in self.font_files else DEFAULT_FAMILY, weight)][1]:
+            # Same font file as Pillow, whose ascender can differ from ReportLab's
+            return self.get(family, weight, size).getmetrics()[0]
+        return pdfmetrics.getAscent(name, size)
+
+# Shared by every label design in this process
+font_registry = FontRegistry()
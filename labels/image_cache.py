@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from PIL import Image
+import hashlib
+import os
+import threading
+from instrumentation import metrics
+
+class ImageCache:
+    """In-process LRU cache of decoded background images, bounded by bytes.
+
+    Entries are keyed by a tuple whose first element is the content hash of
+    the source file, so replacing a file never serves stale pixels and
+    invalidate() can drop everything derived from the old content.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, working_size=(1080, 1200)):
+        self.max_bytes = max_bytes
+        # Smallest size the decoded working copy is allowed to shrink to
+        self.working_size = working_size
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _image_bytes(img):
+        if hasattr(img, 'nbytes'):
+            # Pixel arrays kept for the numpy compositing engine
+            return img.nbytes
+        return img.width * img.height * len(img.getbands())
+
+    def file_hash(self, path):
+        """Content hash of a file, recomputed only when its inode or size changes.
+
+        Not the mtime: the upload janitor touches files on every use. Uploads
+        are replaced by renaming a new file into place, which changes the inode.
+        """
+        stat = os.stat(path)
+        signature = (stat.st_ino, stat.st_size)
+        with self._lock:
+            cached = self._file_hashes.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+
+        with self._lock:
+            self._file_hashes[path] = (signature, content_hash)
+        return content_hash
+
+    def get(self, key):
+        """Return the cached image for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        metrics.cache('image', entry is not None)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, img):
+        """Store an image, evicting least recently used entries to stay within max_bytes"""
+        size = self._image_bytes(img)
+        if size > self.max_bytes:
+            return img
+
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (img, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+        return img
+
+    def working_image(self, path):
+        """Decoded copy of the image at path, pre-downscaled close to the output size.
+
+        The copy is never smaller than working_size in either dimension, so any
+        crop of it can still be resampled down to the label without upscaling.
+        """
+        key = (self.file_hash(path), 'working')
+        img = self.get(key)
+        if img is not None:
+            return img
+
+        with metrics.stage('decode'):
+            img = Image.open(path)
+            # Let the JPEG decoder skip detail we are going to throw away anyway
+            img.draft(img.mode, self.working_size)
+            img.load()
+
+            scale = max(self.working_size[0] / img.width, self.working_size[1] / img.height)
+            if scale < 1:
+                new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+                img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+        return self.put(key, img)
+
+    def invalidate(self, path):
+        """Forget a file and every image derived from its previous content"""
+        with self._lock:
+            cached = self._file_hashes.pop(path, None)
+            if cached is None:
+                return
+            old_hash = cached[1]
+            for key in [k for k in self._entries if k[0] == old_hash]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._file_hashes.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+# Shared by every label design in this process
+image_cache = ImageCache()
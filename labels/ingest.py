@@ -0,0 +1,91 @@
+import io
+from PIL import Image, ImageOps
+from instrumentation import metrics
+
+# Formats accepted for backgrounds and the file extension their copies are stored under
+INGEST_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png'
+}
+
+# EXIF tag holding the camera orientation
+ORIENTATION = 0x0112
+
+def image_format(data):
+    """Format of encoded image bytes from their signature, None when unknown"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'JPEG'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'PNG'
+    return None
+
+def downscale(img, min_size):
+    """Shrink img to the smallest size that still covers min_size in both dimensions.
+
+    Any crop of the result can be resampled to min_size without upscaling.
+    Images that are already smaller are returned unchanged.
+    """
+    scale = max(min_size[0] / img.width, min_size[1] / img.height)
+    if scale >= 1:
+        return img
+    new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+def encode(img, image_format, jpeg_quality=92):
+    output = io.BytesIO()
+    if image_format == 'JPEG':
+        img.save(output, format='JPEG', quality=jpeg_quality)
+    else:
+        # Higher levels are several times slower on photos for barely smaller files
+        img.save(output, format='PNG', compress_level=1)
+    return output.getvalue()
+
+def ingest_image(data, max_pixels, master_size, working_size, jpeg_quality=92):
+    """Validate an uploaded background and normalise it for rendering.
+
+    The image is verified, rejected above max_pixels, turned upright
+    according to its EXIF orientation and converted to RGB. Returns
+    (format, master, working): the master covers master_size (print
+    resolution) and the working copy covers working_size (editor previews),
+    both encoded in the format of the upload. Raises ValueError for anything
+    that is not a usable JPEG or PNG. Module-level so it can run in a render
+    worker.
+    """
+    with metrics.stage('ingest'):
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                img_format = img.format
+                size = img.size
+                img.verify()
+        except Image.DecompressionBombError as e:
+            raise ValueError('Image has too many pixels') from e
+        except Exception as e:
+            raise ValueError('Not a valid JPEG or PNG image') from e
+
+        if img_format not in INGEST_FORMATS:
+            raise ValueError(f'Unsupported image format: {img_format}')
+        if size[0] * size[1] > max_pixels:
+            raise ValueError(f'Image has too many pixels ({size[0]}x{size[1]})')
+
+        # verify() leaves the image unusable, decode from a fresh one
+        original = Image.open(io.BytesIO(data))
+        # Let the JPEG decoder skip detail the master drops anyway, either side may end up the width
+        side = max(master_size)
+        original.draft('RGB', (side, side))
+        img = ImageOps.exif_transpose(original)
+        if img.mode != 'RGB':
+            # Same as pasting onto the label, which ignores transparency
+            img = img.convert('RGB')
+        master = downscale(img, master_size)
+
+        # An upright RGB image of the right size is kept as uploaded, not re-encoded
+        unchanged = (
+            master.size == size and original.mode == 'RGB'
+            and original.getexif().get(ORIENTATION, 1) == 1
+        )
+        working = downscale(master, working_size)
+        return (
+            img_format,
+            data if unchanged else encode(master, img_format, jpeg_quality),
+            encode(working, img_format, jpeg_quality)
+        )
@@ -0,0 +1,359 @@
+from PIL import Image, ImageColor, ImageDraw
+from reportlab.lib.utils import ImageReader
+import io
+import logging
+from .base_label import BaseLabel
+from .image_cache import image_cache
+from .fonts import font_registry
+from .compositing import compositor
+from .design_engine import design_registry, Fields, DEFAULT_DESIGN
+from .layer_cache import layer_cache
+from pdf_generator import PDFGenerator, VectorLabel
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+# Where ReportLab's origin goes for content rotated into a box at (left, bottom, width, height)
+ROTATION_ORIGINS = {
+    0: lambda left, bottom, width, height: (left, bottom),
+    90: lambda left, bottom, width, height: (left + width, bottom),
+    180: lambda left, bottom, width, height: (left + width, bottom + height),
+    270: lambda left, bottom, width, height: (left, bottom + height)
+}
+
+class LabelDesign(BaseLabel):
+    """A label drawn from its design's spec (labels/designs/<design_type>.json).
+
+    The spec is compiled once per output size into a draw plan, a render only
+    resolves the texts and colours of label_data against it. Renders for an
+    editing session reuse the layers the last render of that session drew
+    and redraw only those whose inputs changed (see layer_cache.py).
+    """
+
+    def __init__(self, image_path, label_data):
+        self.image_path = image_path
+        self.label_data = label_data.copy()
+        self.label_data['font_size'] = int(self.label_data.get('font_size', 32))
+        self.design = design_registry.get(self.label_data.get('design_type', DEFAULT_DESIGN))
+        self.fields = Fields(self.label_data)
+        self.pdf_generator = PDFGenerator()
+
+    def _resize_and_crop(self, img, target_width, target_height, resample=Image.Resampling.LANCZOS):
+        """Resize and crop image to target aspect ratio while maintaining proportions"""
+        target_ratio = target_width / target_height
+        img_ratio = img.width / img.height
+
+        # Get crop position (0-100%)
+        crop_x = float(self.label_data.get('crop_x', 50)) / 100
+        crop_y = float(self.label_data.get('crop_y', 50)) / 100
+
+        if img_ratio > target_ratio:
+            # Image is wider than target ratio
+            new_width = int(target_ratio * img.height)
+            left = int((img.width - new_width) * crop_x)
+            img = img.crop((left, 0, left + new_width, img.height))
+        else:
+            # Image is taller than target ratio
+            new_height = int(img.width / target_ratio)
+            top = int((img.height - new_height) * crop_y)
+            img = img.crop((0, top, img.width, top + new_height))
+
+        # Resize to target dimensions
+        return img.resize((target_width, target_height), resample)
+
+    def _background_placement(self, plan, resample):
+        """Cache key of the cropped background and where it is pasted, (None, (0, 0)) without an image"""
+        if not self.image_path or plan.background is None:
+            return None, (0, 0)
+
+        x_pos = float(self.label_data.get('image_x', 50)) / 100
+        y_pos = float(self.label_data.get('image_y', 50)) / 100
+        target_size = plan.background['target_size']
+
+        cache_key = (
+            image_cache.file_hash(self.image_path),
+            float(self.label_data.get('crop_x', 50)),
+            float(self.label_data.get('crop_y', 50)),
+            target_size,
+            resample
+        )
+        paste_x = int((plan.size[0] - target_size[0]) * x_pos)
+        paste_y = int((plan.size[1] - target_size[1]) * y_pos)
+        return cache_key, (paste_x, paste_y)
+
+    def _background(self, plan, resample):
+        """The cropped background, its paste position and cache key, None when the label has no image"""
+        cache_key, position = self._background_placement(plan, resample)
+        if cache_key is None:
+            return None, position, None
+
+        # Reuse the decoded, cropped and resampled background when nothing changed
+        img = image_cache.get(cache_key)
+        if img is None:
+            working = image_cache.working_image(self.image_path)
+            with metrics.stage('crop_resize'):
+                img = self._resize_and_crop(working, *plan.background['target_size'], resample)
+            image_cache.put(cache_key, img)
+        return img, position, cache_key
+
+    def _layout(self, size):
+        """The draw plan at size and the label's texts laid out on it"""
+        with metrics.stage('layout'):
+            plan = self.design.plan(size)
+            return plan, plan.layout(self.fields)
+
+    @staticmethod
+    def _draw_runs(draw, runs, fill):
+        for text, family, weight, font_size, position in runs:
+            draw.text(position, text, font=font_registry.get(family, weight, font_size), fill=fill)
+
+    def _box_key(self, box):
+        """Everything a text box layer depends on besides the plan"""
+        return (self.design.key, box['runs'], box['color'], box['fill'], box['overlay'], box['overlay_color'])
+
+    def _box_layer(self, box):
+        """A text box with its lines, turned into place and with its overlay, as RGBA"""
+        box_img = Image.new('RGBA', box['plan']['content_size'], box['fill'])
+        self._draw_runs(ImageDraw.Draw(box_img), box['runs'], box['color'])
+        if box['plan']['rotation']:
+            box_img = box_img.rotate(box['plan']['rotation'], expand=True)
+
+        # The overlay makes the box translucent where it covers it
+        if box['overlay']:
+            self._draw_runs(ImageDraw.Draw(box_img), [box['overlay']], box['overlay_color'])
+        return box_img
+
+    def _box_masks(self, box):
+        """Coverage of a text box's lines (unrotated) and of its overlay (rotated), mode 'L'"""
+        text_mask = Image.new('L', box['plan']['content_size'], 0)
+        self._draw_runs(ImageDraw.Draw(text_mask), box['runs'], 255)
+        overlay_mask = Image.new('L', box['plan']['size'], 0)
+        if box['overlay']:
+            self._draw_runs(ImageDraw.Draw(overlay_mask), [box['overlay']], 255)
+        return text_mask, overlay_mask
+
+    def _background_layer(self, plan, fill, resample):
+        """The label canvas with the background pasted, everything below the text boxes"""
+        background, background_pos, _ = self._background(plan, resample)
+        with metrics.stage('composite'):
+            base = Image.new('RGB', plan.size, fill)
+            if background is not None:
+                base.paste(background, background_pos)
+        return base
+
+    def _create_label(self, size, resample=Image.Resampling.LANCZOS, session=None):
+        plan, layout = self._layout(size)
+        if not plan.standard_order:
+            return self._composite_images(plan, layout, resample)
+        if compositor.engine == 'numpy':
+            return self._composite_arrays(plan, layout, resample, session)
+        return self._composite_layers(plan, layout, resample, session)
+
+    def _composite_layers(self, plan, layout, resample, session):
+        """Paste the text box layers onto the background layer and draw the border.
+
+        Within a session both kinds of layer come from the layer cache unless
+        their inputs changed.
+        """
+        background_key, background_pos = self._background_placement(plan, resample)
+        fill = plan.fill(background_key is not None)
+        base = layer_cache.layer(
+            session, ('background', plan.size), (self.design.key, fill, background_key, background_pos),
+            lambda: self._background_layer(plan, fill, resample)
+        )
+
+        with metrics.stage('text_draw'):
+            box_images = [
+                layer_cache.layer(
+                    session, ('text_box', plan.size, index), self._box_key(box),
+                    lambda box=box: self._box_layer(box)
+                )
+                for index, box in enumerate(layout['boxes'])
+            ]
+
+        with metrics.stage('composite'):
+            # Cached layers are shared, draw on a copy
+            final_img = base.copy() if session is not None else base
+            for box, box_img in zip(layout['boxes'], box_images):
+                final_img.paste(box_img, box['plan']['pos'], mask=box_img)
+            if plan.border:
+                ImageDraw.Draw(final_img).rectangle(
+                    [(0, 0), (plan.size[0] - 1, plan.size[1] - 1)],
+                    outline=layout['border_color'],
+                    width=plan.border['width']
+                )
+        return final_img
+
+    def _composite_images(self, plan, layout, resample):
+        """Build the label from a chain of Pillow images, following the spec's layer order"""
+        background, background_pos, _ = self._background(plan, resample)
+        with metrics.stage('text_draw'):
+            box_images = [self._box_layer(box) for box in layout['boxes']]
+
+        with metrics.stage('composite'):
+            final_img = Image.new('RGB', plan.size, plan.fill(background is not None))
+            for kind, data in plan.layers:
+                if kind == 'background' and background is not None:
+                    final_img.paste(background, background_pos)
+                elif kind == 'text_box':
+                    final_img.paste(box_images[data], layout['boxes'][data]['plan']['pos'], mask=box_images[data])
+                elif kind == 'border':
+                    ImageDraw.Draw(final_img).rectangle(
+                        [(0, 0), (plan.size[0] - 1, plan.size[1] - 1)],
+                        outline=layout['border_color'],
+                        width=data['width']
+                    )
+        return final_img
+
+    def _composite_arrays(self, plan, layout, resample, session):
+        """Draw only coverage masks, the compositor blends them into the output"""
+        background, background_pos, background_key = self._background(plan, resample)
+        with metrics.stage('text_draw'):
+            boxes = []
+            for index, box in enumerate(layout['boxes']):
+                text_mask, overlay_mask = layer_cache.layer(
+                    session, ('text_mask', plan.size, index), (self.design.key, box['runs'], box['overlay']),
+                    lambda box=box: self._box_masks(box)
+                )
+                boxes.append((
+                    box['plan']['pos'], box['plan']['rotation'], ImageColor.getrgb(box['fill'])[:3],
+                    text_mask, box['color'], overlay_mask, box['overlay_color'] or (0, 0, 0, 0)
+                ))
+
+        with metrics.stage('composite'):
+            pixels = None
+            if background is not None:
+                pixels = compositor.background_array(background, background_key)
+            return compositor.composite(
+                plan.size, plan.fill(background is not None), pixels, background_pos, boxes,
+                layout['border_color'], plan.border['width'] if plan.border else 0
+            )
+
+    def _print_backgrounds(self, plan, layout, quality):
+        """JPEG bytes of the background with the box areas filled, and of each box area under its overlay.
+
+        The first is all the bitmap a vector PDF needs. The others are what
+        an overlay lets show through its box, blended like the raster path,
+        None for boxes without one.
+        """
+        background, background_pos, _ = self._background(plan, Image.Resampling.LANCZOS)
+        base = Image.new('RGB', plan.size, plan.fill(background is not None))
+        if background is not None:
+            base.paste(background, background_pos)
+
+        shaded = []
+        for box in layout['boxes']:
+            left, top = box['plan']['pos']
+            width, height = box['plan']['size']
+            if not box['overlay']:
+                shaded.append(None)
+                continue
+            # Same rounding as Pillow's blend of the overlay colour at its alpha
+            *color, alpha = box['overlay_color']
+            table = []
+            for channel in color:
+                for v in range(256):
+                    value = v * (255 - alpha) + channel * alpha + 128
+                    table.append((value + (value >> 8)) >> 8)
+            shaded.append(base.crop((left, top, left + width, top + height)).point(table))
+
+        # The boxes hide these areas, a flat fill compresses to nothing
+        draw = ImageDraw.Draw(base)
+        for box in layout['boxes']:
+            left, top = box['plan']['pos']
+            width, height = box['plan']['size']
+            draw.rectangle([(left, top), (left + width - 1, top + height - 1)], fill=box['fill'])
+
+        encoded = []
+        with metrics.stage('encode'):
+            for img in [base] + shaded:
+                if img is None:
+                    encoded.append(None)
+                    continue
+                output = io.BytesIO()
+                img.save(output, format='JPEG', quality=quality)
+                encoded.append(output.getvalue())
+        return encoded[0], encoded[1:]
+
+    @staticmethod
+    def _rgb(color):
+        return [channel / 255 for channel in ImageColor.getrgb(color)[:3]]
+
+    @staticmethod
+    def _draw_pdf(c, size, plan, layout, background, shaded_boxes):
+        """Draw the label with ReportLab: the background is the only bitmap, text stays vector.
+
+        Units are label pixels with the origin at the bottom left, matching the
+        raster layout flipped vertically. Static, so a VectorLabel sent back
+        from a render worker does not carry the design with it.
+        """
+        width, height = size
+
+        def draw_run(text_object, run, left, top):
+            # Pillow places (x, y) at the ascender line, ReportLab at the baseline
+            text, family, weight, font_size, (x, y) = run
+            font_name = font_registry.pdf_font(family, weight)
+            text_object.setFont(font_name, font_size)
+            text_object.setTextOrigin(left + x, top - y - font_registry.pdf_ascent(family, weight, font_size))
+            text_object.textOut(text)
+
+        c.drawImage(ImageReader(io.BytesIO(background)), 0, 0, width=width, height=height)
+
+        for box, shaded_box in zip(layout['boxes'], shaded_boxes):
+            box_left, box_top = box['plan']['pos']
+            box_width, box_height = box['plan']['size']
+            box_bottom = height - box_top - box_height
+
+            # Lines are drawn in the unrotated box and turned into place like the raster box
+            rotation = box['plan']['rotation']
+            c.saveState()
+            c.translate(*ROTATION_ORIGINS[rotation](box_left, box_bottom, box_width, box_height))
+            c.rotate(rotation)
+            c.setFillColorRGB(*LabelDesign._rgb(box['color']))
+            for run in box['runs']:
+                text_object = c.beginText()
+                draw_run(text_object, run, 0, box['plan']['content_size'][1])
+                c.drawText(text_object)
+            c.restoreState()
+
+            # The overlay shows the blended background through the box
+            if box['overlay']:
+                c.saveState()
+                text_object = c.beginText()
+                text_object.setTextRenderMode(7)  # add the glyph to the clipping path
+                draw_run(text_object, box['overlay'], box_left, height - box_top)
+                c.drawText(text_object)
+                c.drawImage(ImageReader(io.BytesIO(shaded_box)), box_left, box_bottom,
+                            width=box_width, height=box_height)
+                c.restoreState()
+
+        if plan.border:
+            border_width = plan.border['width']
+            c.setStrokeColorRGB(*LabelDesign._rgb(layout['border_color']))
+            c.setLineWidth(border_width)
+            c.rect(border_width / 2, border_width / 2, width - border_width, height - border_width,
+                   stroke=1, fill=0)
+
+    def render(self, size, resample=Image.Resampling.LANCZOS, session=None):
+        return self._create_label(size, resample, session)
+
+    def render_print(self, size, vector_text=True, background_quality=90):
+        plan, layout = self._layout(size)
+        if not vector_text or not plan.standard_order:
+            return self.render(size)
+        background, shaded_boxes = self._print_backgrounds(plan, layout, background_quality)
+        return VectorLabel(size, self._draw_pdf, plan, layout, background, shaded_boxes)
+
+    def generate_pdf(self, output, bottle_size='500ML', dpi=300, vector_text=True):
+        # Bottle and keg labels use the same artwork, render it once at print resolution
+        size = self.pdf_generator.pixel_size(bottle_size, dpi)
+        label = self.render_print(size, vector_text)
+
+        logger.debug("Rendered print label at %dx%d", *size)
+
+        self.pdf_generator.generate_pdf(
+            output,
+            bottle_label=label,
+            keg_label=label,
+            bottle_size=bottle_size
+        )
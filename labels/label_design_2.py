@@ -1,43 +0,0 @@
-from PIL import Image, ImageDraw, ImageFont
-import os
-import uuid
-from .base_label import BaseLabel
-from pdf_generator import PDFGenerator
-
-class LabelDesign2(BaseLabel):
-    def __init__(self, image_path, label_data):
-        self.image_path = image_path
-        self.label_data = label_data.copy()
-        self.preview_folder = 'static/uploads'
-        self.pdf_generator = PDFGenerator(preview_folder=self.preview_folder)
-    
-    def generate_preview(self):
-        """
-        Placeholder implementation - replace with actual design
-        Returns path to preview image
-        """
-        # Create a blank image for now
-        img = Image.new('RGB', (540, 600), 'white')
-        draw = ImageDraw.Draw(img)
-        draw.text((270, 300), "Label Design 2", fill='black', anchor="mm")
-        
-        preview_path = os.path.join(self.preview_folder, f'preview_{uuid.uuid4()}.png')
-        img.save(preview_path)
-        return preview_path
-    
-    def generate_pdf(self, uuid, bottle_size='500ML'):
-        """
-        Placeholder implementation - replace with actual design
-        Returns path to generated PDF
-        """
-        # Create a simple label for demonstration
-        img = Image.new('RGB', (540, 600), 'white')
-        draw = ImageDraw.Draw(img)
-        draw.text((270, 300), "Label Design 2", fill='black', anchor="mm")
-        
-        return self.pdf_generator.generate_pdf(
-            uuid=uuid,
-            bottle_label=img,
-            keg_label=img,
-            bottle_size=bottle_size
-        ) 
\ No newline at end of file
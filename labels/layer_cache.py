@@ -0,0 +1,77 @@
+from collections import OrderedDict
+import threading
+from instrumentation import metrics
+
+class LayerCache:
+    """Rendered layers of the labels being edited, kept per editing session.
+
+    A session (the label's uuid) keeps the latest version of each of its
+    layers, e.g. the background on the label canvas or one text box, together
+    with the key of everything that layer depends on. A re-render reuses the
+    layers whose key is unchanged and redraws only the others, so changing a
+    colour does not crop, resample and paste the background again. Sessions
+    not rendered for a while are dropped first.
+    """
+
+    def __init__(self, max_sessions=64):
+        self.max_sessions = max_sessions
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session, name, key):
+        """The layer name of session if it was drawn for key, else None"""
+        with self._lock:
+            layers = self._sessions.get(session)
+            entry = layers.get(name) if layers is not None else None
+            hit = entry is not None and entry[0] == key
+            if layers is not None:
+                self._sessions.move_to_end(session)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.cache('layers', hit)
+        return entry[1] if hit else None
+
+    def put(self, session, name, key, layer):
+        """Keep layer as the current version of name for session and return it"""
+        with self._lock:
+            layers = self._sessions.get(session)
+            if layers is None:
+                layers = self._sessions[session] = {}
+            self._sessions.move_to_end(session)
+            layers[name] = (key, layer)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return layer
+
+    def layer(self, session, name, key, draw):
+        """The cached layer for key, drawn with draw() on a miss. Without a session nothing is kept."""
+        if session is None:
+            return draw()
+        layer = self.get(session, name, key)
+        if layer is None:
+            layer = self.put(session, name, key, draw())
+        return layer
+
+    def drop(self, session):
+        with self._lock:
+            self._sessions.pop(session, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'layers': sum(len(layers) for layers in self._sessions.values()),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# Shared by every label render in this process
+layer_cache = LayerCache()
@@ -0,0 +1,118 @@
+import io
+import logging
+from PIL import Image
+from .label_design import LabelDesign
+from .design_engine import design_registry, DESIGN_DIR
+from .fonts import font_registry
+from .image_cache import image_cache
+from .layer_cache import layer_cache
+from .compositing import compositor
+from pdf_generator import PDFGenerator
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+LABEL_SIZE = (540, 600)
+
+# Resolution print PDFs are rendered at
+PDF_DPI = 300
+
+def label_size(scale):
+    """Pixel size of a label rendered at scale times the full-size preview"""
+    return (round(LABEL_SIZE[0] * scale), round(LABEL_SIZE[1] * scale))
+
+def master_size(dpi=PDF_DPI):
+    """Smallest image size that covers every printable label at dpi without upscaling"""
+    generator = PDFGenerator()
+    sizes = [generator.pixel_size(bottle_size, dpi) for bottle_size in generator.label_sizes]
+    return (max(w for w, _ in sizes), max(h for _, h in sizes))
+
+def get_design(design_type):
+    """Return the design for a design type, ValueError when there is no such design"""
+    return design_registry.get(design_type)
+
+def render_label(image_path, label_data, size=LABEL_SIZE, resample='LANCZOS', session=None):
+    """Render one label to a PIL image.
+
+    Module-level so it can be sent to worker processes, resample is the name
+    of a Pillow resampling filter. Renders with the same session reuse the
+    layers that did not change since the previous one.
+    """
+    return LabelDesign(image_path, label_data).render(size, Image.Resampling[resample], session)
+
+PREVIEW_MIMETYPES = {
+    'WEBP': 'image/webp',
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png'
+}
+
+def encode_image(img, image_format='WEBP', quality=80):
+    """Encode an image for the browser, favouring encode speed over size"""
+    image_format = image_format.upper()
+    output = io.BytesIO()
+    with metrics.stage('encode'):
+        if image_format == 'WEBP':
+            img.save(output, format='WEBP', quality=quality, method=0)
+        elif image_format == 'JPEG':
+            img.convert('RGB').save(output, format='JPEG', quality=quality)
+        elif image_format == 'PNG':
+            img.save(output, format='PNG', compress_level=1)
+        else:
+            raise ValueError(f"Unsupported preview format: {image_format}")
+    return output.getvalue()
+
+def render_preview(image_path, label_data, image_format='WEBP', quality=80,
+                   size=LABEL_SIZE, resample='LANCZOS', session=None):
+    """Render the preview image for a label and return the encoded bytes"""
+    return encode_image(render_label(image_path, label_data, size, resample, session), image_format, quality)
+
+def encode_thumbnail(img, size, image_format='WEBP', quality=75):
+    """Downscale a rendered label to thumbnail size and encode it"""
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+    return encode_image(img.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0), image_format, quality)
+
+def render_thumbnail(image_path, label_data, size, image_format='WEBP', quality=75):
+    """Render a label and return its encoded thumbnail"""
+    return encode_thumbnail(render_label(image_path, label_data), size, image_format, quality)
+
+def render_print_label(image_path, label_data, size, vector_text=True):
+    """Artwork of one label for a print PDF, with vector text when the design supports it"""
+    return LabelDesign(image_path, label_data).render_print(size, vector_text)
+
+def render_pdf(image_path, label_data, bottle_size, dpi=PDF_DPI, vector_text=True):
+    """Render the print PDF for a label and return its bytes, nothing is written to disk"""
+    output = io.BytesIO()
+    LabelDesign(image_path, label_data).generate_pdf(
+        output, bottle_size=bottle_size, dpi=dpi, vector_text=vector_text
+    )
+    return output.getvalue()
+
+def worker_stats():
+    """Cache sizes and counters of this render worker and the font files it resolved, sent back after every job"""
+    return {
+        'image_cache': image_cache.stats(),
+        'layer_cache': layer_cache.stats(),
+        'fonts': font_registry.resolved()
+    }
+
+def warm_worker(font_dir, image_cache_bytes, image_paths=(), compositing_engine='pillow', design_dir=DESIGN_DIR,
+                layer_sessions=64):
+    """Initialise a render worker: resolve fonts, load designs and decode recent backgrounds up front"""
+    compositor.configure(compositing_engine)
+    font_registry.configure(font_dir)
+    design_registry.configure(design_dir)
+    for family in font_registry.font_files:
+        font_registry.get(family, 'bold', 32)
+        font_registry.get(family, 'regular', 22)
+    font_registry.get('Arial', 'bold', 100)
+    for design in design_registry.designs():
+        design.plan(LABEL_SIZE)
+
+    image_cache.max_bytes = image_cache_bytes
+    layer_cache.max_sessions = layer_sessions
+    for path in image_paths:
+        try:
+            image_cache.working_image(path)
+        except Exception as e:
+            logger.warning("Could not preload %s: %s", path, e)
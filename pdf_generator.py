@@ -1,10 +1,36 @@
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-import os
+from reportlab.lib.utils import ImageReader
+import logging
+import time
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+class VectorLabel:
+    """Label artwork drawn with ReportLab operations instead of embedded as one bitmap.
+
+    draw(canvas, size, *args) draws in label pixels (size) with the origin at
+    the bottom left, the generator scales that to the printed label size.
+    """
+
+    def __init__(self, size, draw, *args):
+        self.size = size
+        self.draw = draw
+        self.args = args
+
+    def render(self, c, width, height):
+        """Draw the label at the current origin, scaled to width x height points"""
+        c.saveState()
+        c.scale(width / self.size[0], height / self.size[1])
+        self.draw(c, self.size, *self.args)
+        c.restoreState()
 
 class PDFGenerator:
-    def __init__(self, preview_folder='static/uploads'):
-        self.preview_folder = preview_folder
+    def __init__(self, reuse_images=True):
+        # Embed each label bitmap once and reference it from every tile,
+        # instead of re-encoding it inline at every grid position
+        self.reuse_images = reuse_images
         # Define standard sizes in cm, converted to points (1 cm = 28.35 points)
         self.label_sizes = {
             '500ML': {
@@ -24,28 +50,15 @@ class PDFGenerator:
             'height': height_cm * 28.35
         }
 
-    def generate_pdf(self, beer_name, bottle_label, keg_label, bottle_size='500ML'):
-        """
-        Generate PDF with bottle and keg labels
-        
-        Args:
-            bottle_label: PIL Image object for the bottle label
-            keg_label: PIL Image object for the keg label
-            bottle_size: Size key from label_sizes dict ('500ML' or '330ML')
-        """
+    def pixel_size(self, bottle_size, dpi=300):
+        """Pixel size a label needs to print at bottle_size with the given resolution"""
         if bottle_size not in self.label_sizes:
             raise ValueError(f"Unknown bottle size: {bottle_size}")
-
-        # Get label dimensions
         label_dims = self.label_sizes[bottle_size]
-        label_width = label_dims['width']
-        label_height = label_dims['height']
+        return (round(label_dims['width'] / 72 * dpi), round(label_dims['height'] / 72 * dpi))
 
-        # Create PDF
-        pdf_path = os.path.join(self.preview_folder, f'label_{beer_name}.pdf')
-        c = canvas.Canvas(pdf_path, pagesize=A4)
-        
-        # Page 1: Bottle Labels
+    def _grid_positions(self, label_width, label_height):
+        """Bottom-left corners of every label slot on an A4 page"""
         page_width, page_height = A4
         margin = 36  # 0.5 inch margin
         spacing = 5  # space between labels
@@ -75,10 +88,75 @@ class PDFGenerator:
                 x = margin + (col * (label_width + h_spacing))
                 y = page_height - margin - label_height - (row * (label_height + v_spacing))
                 positions.append((x, y))
+        return positions
+
+    def _register_label(self, c, name, label_image, width, height):
+        """Embed a label (bitmap or VectorLabel) once as a form XObject of the given size in points"""
+        c.beginForm(name, 0, 0, width, height)
+        if isinstance(label_image, VectorLabel):
+            label_image.render(c, width, height)
+        else:
+            c.drawImage(ImageReader(label_image), 0, 0, width=width, height=height)
+        c.endForm()
+
+    def _draw_label(self, c, name, label_image, form_size, x, y, width, height):
+        """Draw a label at (x, y), scaling its form to width x height"""
+        if not self.reuse_images:
+            if isinstance(label_image, VectorLabel):
+                c.saveState()
+                c.translate(x, y)
+                label_image.render(c, width, height)
+                c.restoreState()
+            else:
+                c.drawInlineImage(label_image, x, y, width=width, height=height)
+            return
+
+        c.saveState()
+        c.translate(x, y)
+        c.scale(width / form_size[0], height / form_size[1])
+        c.doForm(name)
+        c.restoreState()
+
+    def generate_pdf(self, output, bottle_label, keg_label, bottle_size='500ML'):
+        """
+        Generate PDF with bottle and keg labels
+        
+        Args:
+            output: Path or binary file object the PDF is written to
+            bottle_label: PIL Image or VectorLabel for the bottle label
+            keg_label: PIL Image or VectorLabel for the keg label
+            bottle_size: Size key from label_sizes dict ('500ML' or '330ML')
+        """
+        if bottle_size not in self.label_sizes:
+            raise ValueError(f"Unknown bottle size: {bottle_size}")
+        start = time.perf_counter()
+
+        # Get label dimensions
+        label_dims = self.label_sizes[bottle_size]
+        label_width = label_dims['width']
+        label_height = label_dims['height']
+
+        # Create PDF
+        c = canvas.Canvas(output, pagesize=A4)
+        
+        # Page 1: Bottle Labels
+        page_width, page_height = A4
+        margin = 36  # 0.5 inch margin
+        positions = self._grid_positions(label_width, label_height)
         
+        # Embed each distinct label once, bottle and keg often share the same bitmap
+        form_size = (label_width, label_height)
+        forms = {}
+        if self.reuse_images:
+            for label_image in (bottle_label, keg_label):
+                if id(label_image) not in forms:
+                    forms[id(label_image)] = f'label{len(forms)}'
+                    self._register_label(c, forms[id(label_image)], label_image, label_width, label_height)
+
         # Draw bottle labels
         for x, y in positions:
-            c.drawInlineImage(bottle_label, x, y, width=label_width, height=label_height)
+            self._draw_label(c, forms.get(id(bottle_label)), bottle_label, form_size,
+                             x, y, label_width, label_height)
             c.setFont("Helvetica", 8)
             c.drawString(x, y - 10, f"Bottle Label ({bottle_size})")
         
@@ -90,11 +168,68 @@ class PDFGenerator:
         x = (page_width - keg_size) / 2
         y = (page_height - keg_size) / 2
         
-        c.drawInlineImage(keg_label, x, y, width=keg_size, height=keg_size)
+        self._draw_label(c, forms.get(id(keg_label)), keg_label, form_size,
+                         x, y, keg_size, keg_size)
         c.setFont("Helvetica", 10)
         c.drawString(x, y - 20, "Keg Label (Square)")
         
         c.save()
 
-        print("PDF generated at: ", pdf_path)
-        return pdf_path 
\ No newline at end of file
+        metrics.observe('stage_seconds', time.perf_counter() - start, stage='pdf_build')
+        logger.debug("PDF generated for %s labels", bottle_size)
+
+    def generate_batch_pdf(self, output, labels, bottle_size='500ML'):
+        """
+        Generate print sheets for many labels, packed onto as few A4 pages as possible
+        
+        Args:
+            output: Path or binary file object the PDF is written to
+            labels: Iterable of (name, PIL Image or VectorLabel, quantity) tuples. It is consumed
+                lazily, so labels can still be rendering while earlier pages are laid out
+            bottle_size: Size key from label_sizes dict ('500ML' or '330ML')
+
+        Returns the number of pages written.
+        """
+        if bottle_size not in self.label_sizes:
+            raise ValueError(f"Unknown bottle size: {bottle_size}")
+
+        label_dims = self.label_sizes[bottle_size]
+        label_width = label_dims['width']
+        label_height = label_dims['height']
+        form_size = (label_width, label_height)
+
+        c = canvas.Canvas(output, pagesize=A4)
+        positions = self._grid_positions(label_width, label_height)
+        slot = 0
+        pages = 0
+        # Only time spent here counts, not waiting for the labels to render
+        build_seconds = 0.0
+
+        for index, (name, label_image, quantity) in enumerate(labels):
+            start = time.perf_counter()
+            form_name = f'label{index}'
+            if self.reuse_images:
+                self._register_label(c, form_name, label_image, label_width, label_height)
+
+            for _ in range(quantity):
+                if slot == len(positions):
+                    c.showPage()
+                    pages += 1
+                    slot = 0
+                x, y = positions[slot]
+                self._draw_label(c, form_name, label_image, form_size,
+                                 x, y, label_width, label_height)
+                c.setFont("Helvetica", 8)
+                c.drawString(x, y - 10, f"{name} ({bottle_size})")
+                slot += 1
+            build_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        if slot:
+            pages += 1
+        c.save()
+        build_seconds += time.perf_counter() - start
+
+        metrics.observe('stage_seconds', build_seconds, stage='pdf_build')
+        logger.info("Batch PDF generated with %d pages", pages)
+        return pages
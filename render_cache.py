@@ -0,0 +1,162 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from instrumentation import metrics
+
+# Bump whenever a change to the label designs alters their rendered output
+RENDERER_VERSION = 1
+
+class RenderCache:
+    """Content-addressed cache of rendered outputs (encoded previews, PDFs).
+
+    Two tiers: a byte-bounded LRU in memory in front of a size-bounded
+    directory on disk. Entries put with disk=False (previews, which are
+    cheap to redraw and change with every edit) stay in memory only. Keys
+    come from make_key() so identical inputs always map to the same entry
+    and stale entries are never served.
+    """
+
+    def __init__(self, cache_dir='cache/renders', memory_bytes=32 * 1024 * 1024,
+                 disk_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind, design_type, label_data, image_hash, size, **extra):
+        """Canonical hash of everything that determines a rendered output"""
+        key = json.dumps({
+            'kind': kind,
+            'design_type': design_type,
+            'label_data': label_data,
+            'image_hash': image_hash,
+            'size': list(size),
+            'extra': extra,
+            'renderer_version': RENDERER_VERSION
+        }, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= len(self._memory.pop(key))
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def get(self, key, disk=True):
+        """Return cached bytes for key, or None. With disk=False only memory is searched"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+        if data is not None:
+            metrics.cache('render', True)
+            return data
+        if not disk:
+            with self._lock:
+                self.misses += 1
+            metrics.cache('render', False)
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Keep the file's mtime as its last use for disk eviction
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            metrics.cache('render', False)
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+        metrics.cache('render', True)
+        self._remember(key, data)
+        return data
+
+    def put(self, key, data, disk=True):
+        """Store bytes in memory and, unless disk is False, on disk"""
+        self._remember(key, data)
+        if not disk:
+            return data
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._disk_size is not None:
+                self._disk_size += len(data)
+            over_quota = self._disk_size is None or self._disk_size > self.disk_bytes
+        if over_quota:
+            self._evict_disk()
+        return data
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict_disk(self):
+        """Delete least recently used files until the disk tier fits its quota"""
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        if total > self.disk_bytes:
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+                if total <= self.disk_bytes:
+                    break
+        with self._lock:
+            self._disk_size = total
+            self.evictions += evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_size,
+                'disk_bytes': self._disk_size,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
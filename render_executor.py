@@ -0,0 +1,283 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError, CancelledError, BrokenExecutor
+from collections import deque
+import itertools
+import logging
+import os
+import threading
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+class RenderError(Exception):
+    """Base class for jobs the executor could not complete"""
+
+class RenderQueueFull(RenderError):
+    """Raised when a render job cannot be queued because the executor is saturated"""
+
+class RenderTimeout(RenderError):
+    """Raised when a render job does not finish within its timeout"""
+
+class RenderSuperseded(RenderError):
+    """Raised when a newer job for the same key replaced this one before it finished"""
+
+class RenderWorkerLost(RenderError):
+    """Raised when a worker died (killed, out of memory, crashed) and took its pool down"""
+
+class RenderExecutor:
+    """Runs CPU-bound render jobs off the request threads with a bounded queue.
+
+    Backends:
+        'process': warm pool of worker processes (default)
+        'thread': thread pool in this process, useful for debugging
+
+    worker_stats, a module-level function, runs in the worker after every
+    job; the latest result from each worker process is kept for
+    worker_stats_snapshots(), e.g. for the sizes of caches that only exist
+    in the workers.
+
+    A worker that dies breaks its whole process pool. The pool is then
+    replaced by a fresh, warmed up one, and the jobs it lost fail with
+    RenderWorkerLost.
+    """
+
+    def __init__(self, backend='process', max_workers=2, max_queue=16, timeout=30,
+                 initializer=None, initargs=(), worker_stats=None):
+        if backend not in ('process', 'thread'):
+            raise ValueError(f"Unknown render backend: {backend}")
+
+        self.backend = backend
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._initializer = initializer
+        self._initargs = initargs
+        self._worker_stats = worker_stats
+        # Latest worker_stats() result per worker process id
+        self._worker_snapshots = {}
+        self._executor = None
+        # One slot per job that may be running or waiting
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.superseded = 0
+        self.restarts = 0
+        # Latest-wins bookkeeping for submit_latest(), keyed by e.g. label uuid
+        self._generation_counter = itertools.count(1)
+        self._latest_generation = {}
+        self._latest_future = {}
+
+    def _new_executor(self):
+        if self.backend == 'process':
+            return ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=self._initializer,
+                initargs=self._initargs
+            )
+        return ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=self._initializer,
+            initargs=self._initargs
+        )
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            return self._executor
+
+    def _warm(self, executor):
+        for future in [executor.submit(_noop) for _ in range(self.max_workers)]:
+            future.result()
+
+    def warm_up(self):
+        """Start every worker now so the first requests don't pay for process start-up"""
+        self._warm(self._get_executor())
+
+    def _replace_broken(self, executor):
+        """Swap a broken pool for a new one, warmed up in the background"""
+        with self._lock:
+            if self._executor is not executor:
+                # Already replaced, or shut down
+                return
+            replacement = self._executor = self._new_executor()
+            self.restarts += 1
+            self._worker_snapshots.clear()
+        logger.warning("A render worker died, restarting the render pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        def warm():
+            try:
+                self._warm(replacement)
+            except Exception as e:
+                # Shut down meanwhile, or broken again and replaced by its own callback
+                logger.warning("Could not warm up the new render pool: %s", e)
+        threading.Thread(target=warm, name='render-pool-warm-up', daemon=True).start()
+
+    def _check_broken(self, executor, future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenExecutor):
+            self._replace_broken(executor)
+
+    def _job_done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def submit(self, fn, *args, block=False):
+        """Queue a job and return its future, raising RenderQueueFull when saturated"""
+        acquired = self._slots.acquire(timeout=self.timeout) if block else self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            raise RenderQueueFull('Render queue is full')
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_instrumented, self._worker_stats, fn, *args)
+        except BrokenExecutor:
+            self._slots.release()
+            self._replace_broken(executor)
+            raise RenderWorkerLost('A render worker died, please retry')
+        except RuntimeError:
+            self._slots.release()
+            if executor is not self._executor:
+                # The pool was replaced between picking it and submitting to it
+                raise RenderWorkerLost('A render worker died, please retry')
+            raise
+
+        with self._lock:
+            self.in_flight += 1
+        future.add_done_callback(self._job_done)
+        future.add_done_callback(lambda done: self._check_broken(executor, done))
+        return future
+
+    def result(self, future, timeout=None):
+        """Wait for a job, raising RenderTimeout if it takes too long"""
+        try:
+            result, records, (pid, snapshot) = future.result(timeout=timeout or self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise RenderTimeout('Render timed out')
+        except BrokenExecutor:
+            # The pool is replaced by _check_broken()
+            raise RenderWorkerLost('A render worker died, please retry')
+        # Stage timings recorded by the worker while it ran the job
+        metrics.merge(records)
+        if snapshot is not None:
+            with self._lock:
+                self._worker_snapshots[pid] = snapshot
+        return result
+
+    def run(self, fn, *args, timeout=None):
+        """Run a job on the backend and return its result"""
+        return self.result(self.submit(fn, *args), timeout=timeout)
+
+    def submit_latest(self, key, fn, *args):
+        """Queue a job that replaces any unfinished job with the same key.
+
+        A replaced job is cancelled if it has not started yet, otherwise its
+        result is discarded by run_latest(). A job rejected with
+        RenderQueueFull replaces nothing. Returns (future, generation).
+        """
+        future = self.submit(fn, *args)
+
+        with self._lock:
+            generation = next(self._generation_counter)
+            self._latest_generation[key] = generation
+            previous = self._latest_future.pop(key, None)
+            self._latest_future[key] = future
+
+        if previous is not None and previous.cancel():
+            with self._lock:
+                self.superseded += 1
+
+        def forget(done_future):
+            with self._lock:
+                if self._latest_future.get(key) is done_future:
+                    del self._latest_future[key]
+
+        future.add_done_callback(forget)
+        return future, generation
+
+    def is_latest(self, key, generation):
+        with self._lock:
+            return self._latest_generation.get(key) == generation
+
+    def run_latest(self, key, fn, *args, timeout=None):
+        """Run a latest-wins job, raising RenderSuperseded if a newer one arrived meanwhile"""
+        future, generation = self.submit_latest(key, fn, *args)
+        try:
+            result = self.result(future, timeout=timeout)
+        except CancelledError:
+            raise RenderSuperseded('Superseded by a newer render')
+
+        if not self.is_latest(key, generation):
+            with self._lock:
+                self.superseded += 1
+            raise RenderSuperseded('Superseded by a newer render')
+        return result
+
+    def map(self, fn, *iterables):
+        """Lazily run fn over the arguments, yielding results in order.
+
+        Submission waits for free slots instead of failing, and only runs a
+        couple of jobs per worker ahead of the consumer.
+        """
+        window = self.max_workers * 2
+        pending = deque()
+        try:
+            for args in zip(*iterables):
+                pending.append(self.submit(fn, *args, block=True))
+                while len(pending) > window:
+                    yield self.result(pending.popleft())
+            while pending:
+                yield self.result(pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def stats(self):
+        """Queue depth and worker utilisation, in_flight counts running and queued jobs"""
+        with self._lock:
+            running = min(self.in_flight, self.max_workers)
+            return {
+                'backend': self.backend,
+                'workers': self.max_workers,
+                'running': running,
+                'queue_depth': self.in_flight - running,
+                'max_queue': self.max_queue,
+                'utilization': running / self.max_workers,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'superseded': self.superseded,
+                'restarts': self.restarts
+            }
+
+    def worker_stats_snapshots(self):
+        """The latest worker_stats() of each worker that finished a job, one per process"""
+        with self._lock:
+            return list(self._worker_snapshots.values())
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._worker_snapshots.clear()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def _noop():
+    return None
+
+def _instrumented(worker_stats, fn, *args):
+    """Run a job in a worker, returning its result with the metrics it recorded and the worker's stats"""
+    with metrics.collect() as records:
+        with metrics.timer('render_job_seconds', job=fn.__name__):
+            result = fn(*args)
+    snapshot = worker_stats() if worker_stats is not None else None
+    return result, records, (os.getpid(), snapshot)
@@ -1,5 +1,23 @@
-// Function to generate preview
-async function generatePreview(formData) {
+// Object URL of the preview currently shown, released when replaced
+let previewObjectUrl = null;
+
+// Show a rendered preview in the preview section
+function showPreview(previewUrl) {
+    const previewImage = document.getElementById('previewImage');
+    previewImage.src = previewUrl;
+    document.getElementById('preview').style.display = 'block';
+
+    if (previewObjectUrl && previewObjectUrl !== previewUrl) {
+        URL.revokeObjectURL(previewObjectUrl);
+        previewObjectUrl = null;
+    }
+    if (previewUrl.startsWith('blob:')) {
+        previewObjectUrl = previewUrl;
+    }
+}
+
+// Upload the background image once; the server keeps it for later previews
+async function uploadBackground(formData) {
     try {
         const response = await fetch('/upload/' + labelUuid, {
             method: 'POST',
@@ -7,26 +25,87 @@ async function generatePreview(formData) {
         });
         
         const data = await response.json();
-        
+
+        // Stored, but a newer preview replaced this one and will be shown instead
+        if (response.status === 409) {
+            currentFileName = data.original_file;
+            return null;
+        }
+
         if (data.error) {
             alert(data.error);
             return null;
         }
         
-        // Force image reload by adding timestamp
-        const previewImage = document.getElementById('previewImage');
-        previewImage.src = data.preview_url + '?t=' + new Date().getTime();
-        document.getElementById('preview').style.display = 'block';
+        showPreview(data.preview_url);
         
         currentFileName = data.original_file;
         return data.preview_url;
     } catch (error) {
+        console.error('Error:', error);
+        alert('An error occurred while uploading the image');
+        return null;
+    }
+}
+
+// Only the newest preview request matters, older ones are aborted
+let previewController = null;
+let previewTimer = null;
+const PREVIEW_DEBOUNCE_MS = 150;
+
+// Function to generate preview from the label parameters only
+async function generatePreview() {
+    if (!currentFileName) {
+        return null;
+    }
+
+    if (previewController) {
+        previewController.abort();
+    }
+    const controller = new AbortController();
+    previewController = controller;
+
+    try {
+        // GET lets the browser revalidate unchanged previews with their ETag
+        const params = new URLSearchParams(getFormData());
+        const response = await fetch('/preview/' + labelUuid + '?' + params, {
+            signal: controller.signal
+        });
+
+        // A newer preview replaced this one, on the server or here
+        if (response.status === 409 || controller !== previewController) {
+            return null;
+        }
+
+        if (!response.ok) {
+            const data = await response.json();
+            alert(data.error);
+            return null;
+        }
+        
+        const previewUrl = URL.createObjectURL(await response.blob());
+        if (controller !== previewController) {
+            URL.revokeObjectURL(previewUrl);
+            return null;
+        }
+        showPreview(previewUrl);
+        return previewUrl;
+    } catch (error) {
+        if (error.name === 'AbortError') {
+            return null;
+        }
         console.error('Error:', error);
         alert('An error occurred while generating the preview');
         return null;
     }
 }
 
+// Wait until the user pauses before asking for a preview
+function schedulePreview() {
+    clearTimeout(previewTimer);
+    previewTimer = setTimeout(generatePreview, PREVIEW_DEBOUNCE_MS);
+}
+
 // Store the original file name
 let currentFileName = null;
 
@@ -53,8 +132,7 @@ const changeOnlyControls = [
 // Handle form submission
 document.getElementById('labelForm').addEventListener('submit', async (e) => {
     e.preventDefault();
-    const formData = new FormData(e.target);
-    await generatePreview(formData);
+    await generatePreview();
 });
 
 // Add live preview updates for continuous update controls
@@ -64,11 +142,7 @@ continuousUpdateControls.forEach(controlId => {
         // For select elements (like font), only listen for 'change'
         const events = element.tagName.toLowerCase() === 'select' ? ['change'] : ['change', 'input'];
         events.forEach(eventType => {
-            element.addEventListener(eventType, async () => {
-                const form = document.getElementById('labelForm');
-                const formData = new FormData(form);
-                await generatePreview(formData);
-            });
+            element.addEventListener(eventType, schedulePreview);
         });
     }
 });
@@ -77,11 +151,7 @@ continuousUpdateControls.forEach(controlId => {
 changeOnlyControls.forEach(controlId => {
     const element = document.getElementById(controlId);
     if (element) {
-        element.addEventListener('change', async () => {
-            const form = document.getElementById('labelForm');
-            const formData = new FormData(form);
-            await generatePreview(formData);
-        });
+        element.addEventListener('change', schedulePreview);
     }
 });
 
@@ -90,10 +160,10 @@ document.getElementById('background').addEventListener('change', function(e) {
     const placeholder = e.target.parentElement.querySelector('.file-input-placeholder');
     if (this.files && this.files[0]) {
         placeholder.innerHTML = `<span>${this.files[0].name}</span>`;
-        // Trigger preview generation when file is uploaded
+        // Upload the new image once and render the first preview with it
         const form = document.getElementById('labelForm');
         const formData = new FormData(form);
-        generatePreview(formData);
+        uploadBackground(formData);
     } else {
         placeholder.innerHTML = `
             <span>Drop image here or click to upload</span>
@@ -122,12 +192,7 @@ document.getElementById('generatePDF').onclick = async () => {
     const formData = new FormData();
     formData.append('label_data', JSON.stringify(getFormData()));
     
-    // Add the current background file
-    const backgroundInput = document.getElementById('background');
-    if (backgroundInput.files.length > 0) {
-        formData.append('background', backgroundInput.files[0]);
-    }
-    
+    // The background image is already stored on the server
     try {
         const pdfResponse = await fetch('/generate-pdf/' + labelUuid, {
             method: 'POST',
@@ -169,12 +234,7 @@ async function saveLabel() {
     const formData = new FormData();
     formData.append('label_data', JSON.stringify(getFormData()));
     
-    // Add the current background file
-    const backgroundInput = document.getElementById('background');
-    if (backgroundInput.files.length > 0) {
-        formData.append('background', backgroundInput.files[0]);
-    }
-    
+    // The background image is already stored on the server, save-label reuses it
     try {
         const response = await fetch('/save-label/' + labelUuid, {
             method: 'POST',
@@ -205,42 +265,22 @@ document.addEventListener('DOMContentLoaded', async () => {
             }
         });
 
-        // If we have a background image and filename, set up the file input
+        // The image is already stored on the server, only show it
         if (initialData.background && initialData.filename) {
-            try {
-                // Fetch the image file
-                const response = await fetch(initialData.background);
-                const blob = await response.blob();
-                
-                // Create a File object
-                const file = new File([blob], initialData.filename, { type: 'image/png' });
-                
-                // Create a FileList-like object
-                const dataTransfer = new DataTransfer();
-                dataTransfer.items.add(file);
-                
-                // Set the file input's files
-                const fileInput = document.getElementById('background');
-                fileInput.files = dataTransfer.files;
-                
-                // Update the placeholder text
-                const placeholder = document.querySelector('.file-input-placeholder');
-                if (placeholder) {
-                    placeholder.innerHTML = `<span>${initialData.filename}</span>`;
-                }
-                
-                // Set current filename
-                currentFileName = initialData.filename;
-                
-                // Show the preview
-                const previewSection = document.getElementById('preview');
-                const previewImage = document.getElementById('previewImage');
-                if (previewSection && previewImage) {
-                    previewImage.src = initialData.background;
-                    previewSection.style.display = 'block';
-                }
-            } catch (error) {
-                console.error('Error setting up file input:', error);
+            const placeholder = document.querySelector('.file-input-placeholder');
+            if (placeholder) {
+                placeholder.innerHTML = `<span>${initialData.filename}</span>`;
+            }
+            
+            // Set current filename
+            currentFileName = initialData.filename;
+            
+            // Show the preview
+            const previewSection = document.getElementById('preview');
+            const previewImage = document.getElementById('previewImage');
+            if (previewSection && previewImage) {
+                previewImage.src = initialData.background;
+                previewSection.style.display = 'block';
             }
         }
 
@@ -269,23 +309,15 @@ function syncRangeAndNumber(rangeId, numberId) {
     const number = document.getElementById(numberId);
     
     // When range changes, update number and trigger preview
-    range.addEventListener('input', async () => {
+    range.addEventListener('input', () => {
         number.value = range.value;
-        if (currentFileName) {
-            const form = document.getElementById('labelForm');
-            const formData = new FormData(form);
-            await generatePreview(formData);
-        }
+        schedulePreview();
     });
     
     // When number changes, update range and trigger preview
-    number.addEventListener('input', async () => {
+    number.addEventListener('input', () => {
         range.value = number.value;
-        if (currentFileName) {
-            const form = document.getElementById('labelForm');
-            const formData = new FormData(form);
-            await generatePreview(formData);
-        }
+        schedulePreview();
     });
 }
 
@@ -314,6 +346,12 @@ function updateRangeValue(inputId) {
 
 updateRangeValue('crop_x');
 
+// Numeric field value, the server's default while the field is empty or not a number
+function numberValue(inputId, parse, fallback) {
+    const value = parse(document.getElementById(inputId).value);
+    return Number.isFinite(value) ? value : fallback;
+}
+
 // Update or add getFormData function
 function getFormData() {
     return {
@@ -325,10 +363,10 @@ function getFormData() {
         border_color: document.getElementById('border_color').value,
         text_color: document.getElementById('text_color').value,
         font: document.getElementById('font').value,
-        font_size: parseInt(document.getElementById('font_size').value),
-        image_x: parseFloat(document.getElementById('image_x').value),
-        image_y: parseFloat(document.getElementById('image_y').value),
-        crop_x: parseFloat(document.getElementById('crop_x').value)
+        font_size: numberValue('font_size', parseInt, 32),
+        image_x: numberValue('image_x', parseFloat, 50),
+        image_y: numberValue('image_y', parseFloat, 50),
+        crop_x: numberValue('crop_x', parseFloat, 50)
     };
 }
 
@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class UploadJanitor:
+    """Deletes stale files from the upload folder and keeps it under a size quota.
+
+    A file's mtime is its last use: writes set it and touch() refreshes it
+    whenever a request reads the file, so every app process sees the same
+    clock. Files used within active_seconds are never deleted. A sweep first
+    removes everything unused for max_age seconds, then, while the folder is
+    over max_bytes, the least recently used files that restorable(path)
+    reports can be recreated (uploads of saved labels, which the database
+    holds a copy of). on_remove(path) is called for every deleted file.
+    """
+
+    def __init__(self, folder, max_age=7 * 24 * 3600, max_bytes=2 * 1024 * 1024 * 1024,
+                 active_seconds=15 * 60, interval=15 * 60, restorable=None, on_remove=None):
+        self.folder = folder
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.active_seconds = active_seconds
+        self.interval = interval
+        self.restorable = restorable or (lambda path: False)
+        self.on_remove = on_remove
+        self.runs = 0
+        self.files_removed = 0
+        self.bytes_reclaimed = 0
+        self.bytes_stored = None
+        self.last_run = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def touch(path):
+        """Mark a file as just used, returns False when it no longer exists"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path, mtime):
+        """Delete path unless it was used since it was listed"""
+        try:
+            if os.stat(path).st_mtime != mtime:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        if self.on_remove:
+            self.on_remove(path)
+        return True
+
+    def sweep(self):
+        """Run one cleanup pass and return what it reclaimed"""
+        start = time.perf_counter()
+        now = time.time()
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = reclaimed = 0
+
+        kept = []
+        for mtime, size, path in entries:
+            if now - mtime > self.max_age and self._remove(path, mtime):
+                removed += 1
+                reclaimed += size
+                total -= size
+            else:
+                kept.append((mtime, size, path))
+
+        # Oldest first, so the quota costs the least useful files
+        for mtime, size, path in kept:
+            if total <= self.max_bytes:
+                break
+            if now - mtime < self.active_seconds or not self.restorable(path):
+                continue
+            if self._remove(path, mtime):
+                removed += 1
+                reclaimed += size
+                total -= size
+
+        result = {
+            'files_removed': removed,
+            'bytes_reclaimed': reclaimed,
+            'bytes_stored': total,
+            'seconds': time.perf_counter() - start
+        }
+        with self._lock:
+            self.runs += 1
+            self.files_removed += removed
+            self.bytes_reclaimed += reclaimed
+            self.bytes_stored = total
+            self.last_run = now
+        if removed:
+            logger.info("Upload janitor removed %d files, reclaimed %d bytes", removed, reclaimed)
+        return result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.exception("Upload janitor error: %s", e)
+
+    def start(self):
+        """Sweep every interval seconds in a daemon thread, the first sweep after one interval"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='upload-janitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'files_removed': self.files_removed,
+                'bytes_reclaimed': self.bytes_reclaimed,
+                'bytes_stored': self.bytes_stored,
+                'last_run': self.last_run
+            }